@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import traceback
 import logging
 
@@ -12,32 +13,50 @@ import discord
 import jishaku
 from discord.ext import commands
 
-from utils.cache import Cache
+from utils.cache import Cache, MemberCache
 from utils.db import Connection, Blacklist
-from utils.utlities import load_config
+from utils.delivery import DeliveryQueue
+from utils.utlities import load_config, peak_rss_mib
 
 
 async def get_prefix(bot, message):
-    record = bot.cache.get_setting(message.guild.id)
-    return record.prefix
+    return bot.cache.get_prefix(message.guild.id)
 
 
-class Announcer(commands.Bot):
+class Announcer(commands.AutoShardedBot):
     """Announcer is the most simplistic bot when it comes to announcing! No complicated commands, no weird setup!"""
 
-    def __init__(self):
+    def __init__(self, shard_ids=None, shard_count=None):
+        config = load_config()
+        # lazy mode skips member chunking, authors are resolved from the message payload instead
+        lazy_members = getattr(config, "lazy_members", False)
+        if lazy_members:
+            intents = discord.Intents.none()
+            intents.guilds = True
+            intents.guild_messages = True
+            # the help paginator waits for reactions on its own messages
+            intents.guild_reactions = True
+            member_cache_flags = discord.MemberCacheFlags.none()
+        else:
+            # chunking guilds requires the privileged members intent
+            intents = discord.Intents.default()
+            intents.members = True
+            member_cache_flags = discord.MemberCacheFlags.from_intents(intents)
+
         super().__init__(
             command_prefix=get_prefix,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
             description=self.__doc__,
             pm_help=None,
             help_attrs=dict(hidden=True),
-            fetch_offline_members=False,
             heartbeat_timeout=150.0,
             allowed_mentions=discord.AllowedMentions(
                 everyone=True, roles=True, users=True
             ),
-            intents=discord.Intents.default(),
-            chunk_guilds_at_startup=True,
+            intents=intents,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=not lazy_members,
             reconnect=True
         )
 
@@ -45,7 +64,13 @@ class Announcer(commands.Bot):
         self.log = logging.getLogger(__name__)
         self.started_at = datetime.utcnow()
         self.first_startup = True
-        self.config = load_config()
+        # changes received while the startup is still loading the tables, `None` once they're applied
+        self._buffered_changes = None
+        self.config = config
+        self.lazy_members = lazy_members
+
+        # members fetched on demand when a message payload carries no member data
+        self.members = MemberCache()
 
         # Initializing internal cache
         self.cache = Cache()
@@ -53,8 +78,11 @@ class Announcer(commands.Bot):
         # Initializing postgres server connection
         self.pool = Connection()
 
+        # Initializing rate-limited delivery queue
+        self.delivery = DeliveryQueue()
+
         # Initializing blacklist class
-        self.blacklist = Blacklist()
+        self.blacklist = Blacklist(self.pool)
 
         # load extensions
         extensions = ["jishaku", "cogs.dev", "cogs.config", "cogs.restore", "cogs.help", "cogs.events"]
@@ -77,17 +105,16 @@ class Announcer(commands.Bot):
             )
             self.log.info("Successfully established postgres connection")
 
+            # keeping the cache in sync with changes made by other processes, listening starts before
+            # the tables are read so no change is lost, they're buffered until everything is loaded
+            self._buffered_changes = []
+            await self.pool.listen(self.apply_change)
+            self.log.info("Listening for database changes")
+
             # Caching records
             self.cache.init(bot=self)
-            await self.cache.cache_settings()
-            await self.cache.cache_announcements()
-            await self.cache.cache_timed_announcements()
-            await self.cache.cache_raw_announcements()
-            await self.cache.cache_timed_raw_announcements()
-            await self.cache.cache_backup_timed_announcements()
-            await self.cache.cache_timed_raw_announcement_backups()
-            await self.cache.list_timed_announcements()
-            await self.cache.list_timed_raw_announcements()
+            await self.cache.warm_up()
+            self.cache.start_snapshots()
             self.log.info("Succesfully cached records")
 
             self.load_extension('cogs.announcement')
@@ -98,8 +125,16 @@ class Announcer(commands.Bot):
             self.log.info("Successfully cached log channels")
 
             # cache blacklist data
-            self.blacklist.cache()
+            await self.blacklist.load()
             self.log.info("Successfully cached blacklist data")
+            left = await self.leave_blacklisted_guilds()
+            self.log.info(f"Left {left} blacklisted guilds")
+
+            # replaying the changes made while loading
+            changes, self._buffered_changes = self._buffered_changes, None
+            for change in changes:
+                await self.apply_change(change)
+            self.log.info(f"Replayed {len(changes)} database changes made while loading")
 
             # update status message
             await self.status_log_channel.send(
@@ -110,29 +145,82 @@ class Announcer(commands.Bot):
             self.log.info(
                 f"{str(self.user)} started - Average latency: {round(self.latency * 1000)}ms"
             )
+            ready_in = (datetime.utcnow() - self.started_at).total_seconds()
+            peak_rss = peak_rss_mib()
+            peak_rss = "unknown" if peak_rss is None else f"{peak_rss:.1f} MiB"
+            self.log.info(f"Ready in {ready_in:.2f}s with {peak_rss} peak RSS (lazy members: {self.lazy_members})")
+            self.first_startup = False
         else:
             self.log.info(f"Restarted {str(self.user)}")
 
-    async def on_message(self, message):
+    async def close(self):
+        # writing a last snapshot so the next start only fetches what changed meanwhile
+        if not self.first_startup:
+            await self.cache.save_snapshot()
+            # the cache backend's pending writes are flushed before it's closed
+            await self.cache.close()
+        await super().close()
+
+    async def apply_change(self, change):
+        """Route a row change published by another process to the blacklist or internal cache"""
+        if self._buffered_changes is not None:
+            return self._buffered_changes.append(change)
+        if change is None:
+            await self.blacklist.apply_change(None)
+            await self.cache.apply_change(None)
+            await self.leave_blacklisted_guilds()
+        elif change["table"] == "blacklist":
+            if await self.blacklist.apply_change(change):
+                guild = self.get_guild(change["key"])
+                if guild is not None:
+                    await guild.leave()
+        else:
+            await self.cache.apply_change(change)
+
+    async def leave_blacklisted_guilds(self) -> int:
+        """Concurrently leave every blacklisted guild the bot is still in, returns how many were left"""
+        guilds = [guild for guild in self.guilds if self.blacklist.is_blacklisted(guild.id)]
+        results = await asyncio.gather(*(guild.leave() for guild in guilds), return_exceptions=True)
+        for guild, result in zip(guilds, results):
+            if isinstance(result, Exception):
+                self.log.warning(f"Failed to leave blacklisted guild {guild.id}: {result}")
+        return sum(not isinstance(result, Exception) for result in results)
+
+    def may_be_command(self, message):
+        """Cheaply reject messages which can't invoke a command before running the command pipeline"""
         if message.author.bot:
-            return
+            return False
         if not message.guild:
-            return
-        await self.process_commands(message)
+            return False
+        return message.content.startswith(self.cache.get_prefix(message.guild.id))
+
+    async def on_message(self, message):
+        if self.may_be_command(message):
+            await self.process_commands(message)
 
     async def on_message_edit(self, before, after):
-        if before.content != after.content:
+        if before.content != after.content and self.may_be_command(after):
             await self.process_commands(after)
 
     async def on_guild_join(self, guild):
         if self.blacklist.is_blacklisted(guild_id=guild.id):
             await guild.leave()
             return
-        await self.pool.execute("INSERT INTO settings(guild_id, allowed_roles) VALUES($1, $2)", guild.id, [])
-        await self.cache.cache_settings()
+        record = await self.pool.insert_setting(guild.id)
+        self.cache.upsert_setting(record)
+
+    async def on_guild_role_delete(self, role):
+        # a deleted role can't grant permissions anymore, dropping it keeps the allowed roles index in sync
+        if role.id not in self.cache.get_allowed_roles(role.guild.id):
+            return
+        allowed_roles = [role_id for role_id in self.cache.get_setting(role.guild.id).allowed_roles if role_id != role.id]
+        record = await self.pool.update_allowed_roles(role.guild.id, allowed_roles)
+        if record is not None:
+            self.cache.upsert_setting(record)
 
     async def on_guild_remove(self, guild):
         # deleting data's since they removed the bot
         # announcement data would be still exists they won't be deleted
-        await self.pool.execute("DELETE FROM settings WHERE guild_id = $1", guild.id)
-        await self.cache.cache_settings()
+        await self.pool.delete_setting(guild.id)
+        self.cache.evict_setting(guild.id)
+        self.members.evict_guild(guild.id)
@@ -1,12 +1,49 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import aiohttp
 import asyncpg
 import click
 
+from utils.db import AnnouncementRecord
 from utils.utlities import load_config
 
+MIGRATIONS_DIR = "migrations"
+# blacklist kept on disk before it moved to the `blacklist` table
+LEGACY_BLACKLIST = "data/blacklist.json"
+
+
+def list_migrations():
+    """Names of the SQL migration files in the order they should be applied"""
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql"))
+
+
+async def import_legacy_blacklist(conn):
+    """Copy the guild ids of the legacy blacklist file into the `blacklist` table"""
+    if not os.path.exists(LEGACY_BLACKLIST):
+        return
+    with open(LEGACY_BLACKLIST, "r", encoding="utf-8") as blacklist_file:
+        guild_ids = json.load(blacklist_file)["list"]
+    await conn.executemany(
+        "INSERT INTO blacklist(guild_id) VALUES($1) ON CONFLICT DO NOTHING",
+        [(guild_id,) for guild_id in guild_ids],
+    )
+    print(f"CLI >> Imported {len(guild_ids)} blacklisted guilds from {LEGACY_BLACKLIST}")
+
+
+# called with the connection inside the transaction applying the migration
+MIGRATION_HOOKS = {
+    "006_blacklist.sql": import_legacy_blacklist,
+}
+
+
 @click.group(chain=True)
 def cli():
     """Announcer db-launcher"""
@@ -14,12 +51,9 @@ def cli():
 
 @cli.command("initdb", help="Creates database tables.")
 def initdb():
-    schemas = []
-
-    # Opening the schema file
+    # Opening the schema file, it's executed as a whole since function bodies contain semicolons
     with open("schema.sql", "r", encoding="utf-8") as schema_file:
-        data = schema_file.read()
-        schemas = [schema.strip() for schema in data.split(";") if schema.strip()]
+        schema = schema_file.read()
 
     config = load_config()
 
@@ -28,11 +62,17 @@ def initdb():
         conn = await asyncpg.create_pool(
             config.dsn
         )
-        for schema in schemas:
-            try:
-                await conn.execute(f"{schema.strip()};")
-            except Exception as e:
-                print(e)
+        try:
+            await conn.execute(schema)
+        except Exception as e:
+            print(e)
+            return
+        # a fresh schema is already up to date with every migration
+        await conn.executemany(
+            "INSERT INTO schema_migrations(name) VALUES($1) ON CONFLICT DO NOTHING",
+            [(name,) for name in list_migrations()],
+        )
+        await import_legacy_blacklist(conn)
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(do_database_operations())
@@ -40,13 +80,154 @@ def initdb():
     print("CLI >> Database oprations done.")
 
 
+@cli.command("migrate", help="Applies pending database migrations.")
+def migrate():
+    config = load_config()
+
+    async def do_database_operations():
+        conn = await asyncpg.connect(config.dsn)
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations(name TEXT NOT NULL PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        applied = {record["name"] for record in await conn.fetch("SELECT name FROM schema_migrations")}
+        for name in list_migrations():
+            if name in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name), "r", encoding="utf-8") as migration_file:
+                migration = migration_file.read()
+            async with conn.transaction():
+                await conn.execute(migration)
+                if name in MIGRATION_HOOKS:
+                    await MIGRATION_HOOKS[name](conn)
+                await conn.execute("INSERT INTO schema_migrations(name) VALUES($1)", name)
+            print(f"CLI >> Applied migration {name}")
+        await conn.close()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(do_database_operations())
+
+    print("CLI >> Database migrations done.")
+
+
 @cli.command("start", help="Start the bot")
-def start():
+@click.option("--shard-ids", default=None, help="Comma separated shard IDs to run, defaults to all shards.")
+@click.option("--shard-count", type=click.IntRange(min=1), default=None, help="Total number of shards, required with --shard-ids.")
+def start(shard_ids, shard_count):
     from bot import Announcer
 
-    bot = Announcer()
+    if shard_ids is not None:
+        if shard_count is None:
+            raise click.UsageError("--shard-count is required when --shard-ids is given")
+        shard_ids = [int(shard_id) for shard_id in shard_ids.split(",")]
+
+    bot = Announcer(shard_ids=shard_ids, shard_count=shard_count)
     bot.run(bot.config.token)
 
 
+def fetch_recommended_shards(token):
+    """Ask discord how many shards the bot should run"""
+
+    async def do_request():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                "https://discord.com/api/v8/gateway/bot", headers={"Authorization": f"Bot {token}"}
+            ) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data["shards"]
+
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(do_request())
+
+
+@cli.command("cluster", help="Start the bot as several processes, each running a contiguous range of shards")
+@click.option("--processes", "-p", type=click.IntRange(min=1), required=True, help="Number of processes to start.")
+@click.option("--shards", "-s", type=click.IntRange(min=1), default=None, help="Total number of shards, defaults to discord's recommendation.")
+def cluster(processes, shards):
+    config = load_config()
+    if shards is None:
+        shards = fetch_recommended_shards(config.token)
+    processes = min(processes, shards)
+
+    # spreading the shards as evenly as possible, the first processes take the remainder
+    per_process, remainder = divmod(shards, processes)
+    children = []
+    first = 0
+    for index in range(processes):
+        count = per_process + (1 if index < remainder else 0)
+        shard_ids = ",".join(str(shard_id) for shard_id in range(first, first + count))
+        first += count
+        print(f"CLI >> Starting process {index} with shards {shard_ids} of {shards}")
+        children.append(
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "start", "--shard-ids", shard_ids, "--shard-count", str(shards)]
+            )
+        )
+
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+    print("CLI >> Cluster stopped.")
+
+
+# rows shaped like `announcements`, generated by postgres so the benchmark doesn't need any data
+BENCH_QUERY = """SELECT g::bigint AS id, 1000 + g AS announcement_id, g::bigint << 22 AS guild_id, 1::bigint AS channel_id,
+                        'raw' AS kind, 'sent' AS status, NULL::jsonb AS embed_details, 'announcement ' || g AS content,
+                        now() AS expires, now() AS updated_at
+                 FROM generate_series(1, $1) g;"""
+
+
+@cli.command("bench-records", help="Compares decoding rows into record classes with copying them into wrappers.")
+@click.option("--rows", "-r", type=int, default=1_000_000, help="Number of rows to decode.")
+def bench_records(rows):
+    config = load_config()
+
+    class CopiedRecord:
+        """How rows were wrapped before the record classes, every field copied next to the record"""
+
+        def __init__(self, record):
+            self.record = record
+            for name in ("id", "announcement_id", "guild_id", "channel_id", "kind", "status", "embed_details", "content", "expires", "updated_at"):
+                setattr(self, name, record[name])
+
+    async def fetch(conn, variant):
+        if variant == "record_class":
+            return await conn.fetch(BENCH_QUERY, rows, record_class=AnnouncementRecord)
+        return [CopiedRecord(record) for record in await conn.fetch(BENCH_QUERY, rows)]
+
+    async def do_benchmark():
+        conn = await asyncpg.connect(config.dsn)
+        for variant in ("copied", "record_class"):
+            started = time.perf_counter()
+            records = await fetch(conn, variant)
+            decoded = time.perf_counter() - started
+            started = time.perf_counter()
+            for record in records:
+                record.announcement_id, record.guild_id, record.status, record.expires
+            accessed = time.perf_counter() - started
+            del records
+
+            # measured in a second pass since tracing slows allocations down
+            tracemalloc.start()
+            records = await fetch(conn, variant)
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del records
+            print(
+                f"CLI >> {variant:>12}: decode {decoded:.2f}s, attribute access {accessed:.2f}s, "
+                f"retained {retained / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB"
+            )
+        await conn.close()
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(do_benchmark())
+
+
 if __name__ == "__main__":
     cli()
@@ -1,55 +1,173 @@
 # -*- coding: utf-8 -*-
 
 import re
+import os
+import socket
 import asyncio
-from datetime import datetime
+import functools
+import traceback
 
 import discord
-import pytz
-from discord.ext import commands, tasks
+from discord.ext import commands
 
-from utils.utlities import generate_embed, check_allowed, generate_id
+from utils.delivery import PRIORITY_SCHEDULED
+from utils.embeds import EmbedError, build_embed, load_source
+from utils.utlities import generate_embed, can_announce
 from utils.time import parse
 
+# claim mode: seconds before an unfinished claim can be taken over by another worker
+LEASE_SECONDS = 60
+# claim mode: how often the leases of announcements still waiting for delivery are renewed
+LEASE_RENEW_INTERVAL = LEASE_SECONDS / 3
+# claim mode: seconds a claimed announcement may wait for delivery before its lease is left to expire
+DELIVERY_TIMEOUT = 300
+# claim mode: maximum number of claimed announcements waiting for delivery at once
+CLAIM_BATCH_SIZE = 100
+# claim mode: how often the database is checked for announcements scheduled or abandoned by other workers
+CLAIM_POLL_INTERVAL = 15
+# largest attachment accepted by `announcement compose`
+MAX_SOURCE_SIZE = 64 * 1024
+
 class Announcement(commands.Cog):
     """Announcement commands with which you can make announcements!"""
 
     def __init__(self, bot):
         self.bot = bot
-        self.timed_announcements.start()
-        self.raw_timed_announcements.start()
-        self.bot.log.info("Timed announcements tasks started")
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # delivery futures of queued timed announcements by announcement ID
+        self._pending = {}
+        # claim mode: when each pending announcement stops having its lease renewed
+        self._deadlines = {}
+        # IDs of delivered announcements waiting to be marked as sent
+        self._sent = []
+        self._flusher = None
+        if getattr(self.bot.config, "delivery_mode", "local") == "claim":
+            self.lease_owner = self.worker_id
+            self.scheduler_task = self.bot.loop.create_task(self.claimed_timed_announcements())
+            self.lease_task = self.bot.loop.create_task(self.renew_leases())
+        else:
+            self.lease_owner = None
+            self.scheduler_task = self.bot.loop.create_task(self.timed_announcements())
+            self.lease_task = None
+        self.bot.log.info("Timed announcements task started")
+
+    def cog_unload(self):
+        self.scheduler_task.cancel()
+        if self.lease_task is not None:
+            self.lease_task.cancel()
 
-    @tasks.loop(seconds=1)
     async def timed_announcements(self):
-        announcements = self.bot.cache.all_timed_announcements
-        utc = pytz.UTC
-        now = datetime.utcnow().replace(tzinfo=utc)
-        if len(announcements) == 0:
-            return
-        for data in announcements:
-            if now >= data.expires.replace(tzinfo=utc):
-                channel = self.bot.get_channel(data.channel_id)
-                embed = discord.Embed.from_dict(data.embed_details)
-                await self.bot.pool.execute("DELETE FROM timed_announcements WHERE announcement_id = $1", data.announcement_id)
-                await self.bot.cache.cache_timed_announcements()
-                await self.bot.cache.list_timed_announcements()
-                return await channel.send(embed=embed)
-        
-    @tasks.loop(seconds=1)
-    async def raw_timed_announcements(self):
-        announcements = self.bot.cache.all_raw_ta
-        utc = pytz.UTC
-        now = datetime.utcnow().replace(tzinfo=utc)
-        if len(announcements) == 0:
+        """Dispatch timed announcements in batches as the scheduler hands them out"""
+        scheduler = self.bot.cache.scheduler
+        while True:
+            due = await scheduler.get_due()
+            try:
+                self.dispatch_timed_announcements(due)
+            except Exception:
+                self.bot.log.error(traceback.format_exc())
+
+    async def claimed_timed_announcements(self):
+        """Dispatch timed announcements leased from the database, for running several workers at once
+
+        The local scheduler is only used to wake up when an announcement is due, the database
+        is also polled to pick up expired leases of crashed workers.
+        """
+        scheduler = self.bot.cache.scheduler
+        while True:
+            try:
+                await asyncio.wait_for(scheduler.get_due(), timeout=CLAIM_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                # only as many announcements are claimed as can wait for delivery, other workers take the rest
+                while len(self._pending) < CLAIM_BATCH_SIZE:
+                    due = await self.bot.pool.claim_due_announcements(
+                        self.worker_id, LEASE_SECONDS, CLAIM_BATCH_SIZE - len(self._pending), shards=self.bot.cache.shards
+                    )
+                    if not due:
+                        break
+                    for record in due:
+                        self.bot.cache.upsert_announcement(record)
+                    self.dispatch_timed_announcements(due)
+            except Exception:
+                self.bot.log.error(traceback.format_exc())
+
+    async def renew_leases(self):
+        """Keep the leases of claimed announcements alive until they're delivered
+
+        A slow channel can hold announcements in the delivery queue for longer than a lease, the
+        deliveries of announcements whose lease was lost anyway are cancelled so they're only posted
+        by the worker which reclaimed them.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+            # deliveries stuck for too long are given up, so their leases expire and another worker can post them
+            for announcement_id, deadline in list(self._deadlines.items()):
+                future = self._pending.get(announcement_id)
+                if deadline <= loop.time() and future is not None and not future.done():
+                    self.bot.log.warning(f"Delivery of timed announcement #{announcement_id} timed out, releasing its lease")
+                    future.cancel()
+            if not self._pending:
+                continue
+            try:
+                held = set(await self.bot.pool.renew_leases(list(self._pending), self.worker_id, LEASE_SECONDS))
+            except Exception:
+                self.bot.log.error(traceback.format_exc())
+                continue
+            for announcement_id, future in list(self._pending.items()):
+                if announcement_id not in held and not future.done():
+                    self.bot.log.warning(f"Lost the lease of timed announcement #{announcement_id}, cancelling its delivery")
+                    future.cancel()
+
+    def dispatch_timed_announcements(self, due):
+        """Queue due announcements for delivery without waiting on them, each is marked as sent once it's posted
+
+        Every channel drains at its own rate, so a backlog in one channel never holds back the others.
+        """
+        loop = asyncio.get_event_loop()
+        for data in due:
+            if data.announcement_id in self._pending:
+                continue
+            channel = self.bot.get_channel(data.channel_id)
+            if channel is None:
+                future = loop.create_future()
+                future.set_result(None)
+            elif data.kind == "embed":
+                future = self.bot.delivery.send(
+                    channel, priority=PRIORITY_SCHEDULED, embed=discord.Embed.from_dict(data.embed_details)
+                )
+            else:
+                future = self.bot.delivery.send(channel, priority=PRIORITY_SCHEDULED, content=data.content)
+            self._pending[data.announcement_id] = future
+            if self.lease_owner is not None:
+                self._deadlines[data.announcement_id] = loop.time() + DELIVERY_TIMEOUT
+            future.add_done_callback(functools.partial(self._delivered, data.announcement_id))
+
+    def _delivered(self, announcement_id, future):
+        """Queue a delivered announcement to be marked as sent"""
+        if self._pending.get(announcement_id) is future:
+            del self._pending[announcement_id]
+            self._deadlines.pop(announcement_id, None)
+        if future.cancelled():
             return
-        for data in announcements:
-            if now >= data.expires.replace(tzinfo=utc):
-                channel = self.bot.get_channel(data.channel_id)
-                await self.bot.pool.execute("DELETE FROM timed_raw_announcements WHERE announcement_id = $1", data.announcement_id)
-                await self.bot.cache.cache_timed_raw_announcements()
-                await self.bot.cache.list_timed_raw_announcements()
-                return await channel.send(data.content)
+        if future.exception() is not None:
+            self.bot.log.error(f"Failed to post timed announcement #{announcement_id}: {future.exception()!r}")
+        self._sent.append(announcement_id)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self.flush_sent())
+
+    async def flush_sent(self):
+        """Mark delivered announcements as sent, everything delivered meanwhile is marked with one query"""
+        while self._sent:
+            announcement_ids, self._sent = self._sent, []
+            try:
+                records = await self.bot.pool.mark_sent(announcement_ids, owner=self.lease_owner)
+            except Exception:
+                self.bot.log.error(traceback.format_exc())
+                continue
+            for record in records:
+                self.bot.cache.upsert_announcement(record)
 
     @commands.group(invoke_without_command=True, aliases=["a"])
     async def announcement(self, ctx):
@@ -60,12 +178,7 @@ class Announcement(commands.Cog):
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def quick(self, ctx, channel: discord.TextChannel):
         """Interactively creates an embed to suit your needs"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
+        if await can_announce(ctx):
 
             # i'm lazy to make these checks, so used from officialpiyush/modmail-plugins/announcement
             def check(msg: discord.Message):
@@ -346,12 +459,13 @@ class Announcement(commands.Cog):
             except asyncio.TimeoutError:
                 await footer_msg.delete()
                 return await ctx.send("Cancelled the session as it's inactive!")
-            announcement_id = generate_id()
-            embed_details = f'{embed.to_dict()}'.replace("'", '"')
-            await self.bot.pool.execute("INSERT INTO announcements(announcement_id, channel_id, embed_details) VALUES($1, $2, $3);", announcement_id, channel.id, embed_details)
-            await self.bot.cache.cache_announcements()
+            announcement_id = await self.bot.pool.allocate_announcement_id()
+            embed_details = embed.to_dict()
+            async with self.bot.pool.unit_of_work() as unit:
+                unit.insert_announcement(announcement_id, ctx.guild.id, channel.id, "embed", embed_details=embed_details)
+            self.bot.cache.apply_committed(unit)
             await ctx.reply(f":thumbsup: | Your announcement has been successfully posted! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore quick {announcement_id}`.")
-            return await channel.send(embed=embed)
+            return await self.bot.delivery.send(channel, embed=embed)
         else:
             return await ctx.send("You don't have permissions to use this command!")
 
@@ -359,12 +473,7 @@ class Announcement(commands.Cog):
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def timed(self, ctx, channel: discord.TextChannel):
         """Interactively created a timed announcement to suit your needs!"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
+        if await can_announce(ctx):
 
             # i'm lazy to make these checks, so used from officialpiyush/modmail-plugins/announcement
             def check(msg: discord.Message):
@@ -658,29 +767,64 @@ class Announcement(commands.Cog):
             except asyncio.TimeoutError:
                 await time_msg.delete()
                 return await ctx.send("Cancelled the session as it's inactive!")
-            announcement_id = generate_id()
-            embed_details = f'{embed.to_dict()}'.replace("'", '"')
-            await self.bot.pool.execute("INSERT INTO timed_announcements(announcement_id, channel_id, embed_details, expires) VALUES($1, $2, $3, $4);", announcement_id, channel.id, embed_details, parsed_time)
-            await self.bot.cache.cache_timed_announcements()
-            await self.bot.cache.list_timed_announcements()
-            await self.bot.pool.execute("INSERT INTO timed_announcement_backups(announcement_id, channel_id, embed_details, expires) VALUES($1, $2, $3, $4);", announcement_id, channel.id, embed_details, parsed_time)
-            await self.bot.cache.cache_backup_timed_announcements()
+            announcement_id = await self.bot.pool.allocate_announcement_id()
+            embed_details = embed.to_dict()
+            async with self.bot.pool.unit_of_work() as unit:
+                unit.insert_announcement(announcement_id, ctx.guild.id, channel.id, "embed", embed_details=embed_details, expires=parsed_time)
+            self.bot.cache.apply_committed(unit)
             await ctx.reply(f":thumbsup: | Your announcement has been successfully added to the queue! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore timed {announcement_id}`.")
         else:
             return await ctx.send("You don't have permissions to use this command!")
 
+    @announcement.command(aliases=["c"])
+    async def compose(self, ctx, channel: discord.TextChannel, *, source: str = None):
+        """Creates an embed announcement from a single message, no questions asked!
+
+        Write the embed as JSON, YAML or `key: value` lines (`title`, `description`, `color`, `thumbnail`,
+        `image`, `footer`, `author`, `url` and `field: name | value | inline`), in the message or as an
+        attached `.json`, `.yaml` or `.txt` file. Add `time: 10m` to schedule it instead (max time is 24hr).
+        """
+        if await can_announce(ctx):
+            filename = None
+            if source is None:
+                if not ctx.message.attachments:
+                    return await ctx.reply(
+                        f":negative_squared_cross_mark: | Write the announcement after the channel or attach it as a file, see `{ctx.prefix}help announcement compose`"
+                    )
+                attachment = ctx.message.attachments[0]
+                if attachment.size > MAX_SOURCE_SIZE:
+                    return await ctx.reply(f":negative_squared_cross_mark: | The attachment is too large, must be within {MAX_SOURCE_SIZE // 1024}KiB")
+                source = (await attachment.read()).decode("utf-8", "replace")
+                filename = attachment.filename
+            try:
+                embed_details, time = build_embed(load_source(source, filename))
+            except EmbedError as e:
+                problems = "\n".join(f"- {problem}" for problem in e.problems)
+                return await ctx.reply(f":negative_squared_cross_mark: | The announcement is invalid:\n{problems}"[:2000])
+            parsed_time = None
+            if time is not None:
+                try:
+                    parsed_time = parse(time)
+                except Exception:
+                    return await ctx.reply(f":negative_squared_cross_mark: | The given time is invalid or the given time is more than max time(24hr)")
+            announcement_id = await self.bot.pool.allocate_announcement_id()
+            async with self.bot.pool.unit_of_work() as unit:
+                unit.insert_announcement(announcement_id, ctx.guild.id, channel.id, "embed", embed_details=embed_details, expires=parsed_time)
+            self.bot.cache.apply_committed(unit)
+            if parsed_time is not None:
+                return await ctx.reply(f":thumbsup: | Your announcement has been successfully added to the queue! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore timed {announcement_id}`.")
+            await ctx.reply(f":thumbsup: | Your announcement has been successfully posted! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore quick {announcement_id}`.")
+            return await self.bot.delivery.send(channel, embed=discord.Embed.from_dict(embed_details))
+        else:
+            return await ctx.send("You don't have permissions to use this command!")
+
     @announcement.command()
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def timedRaw(self, ctx, channel: discord.TextChannel):
         """Interactively creates a timed raw announcement!"""
-        allowed = await check_allowed(ctx)
         def check(msg: discord.Message):
                 return ctx.author == msg.author and ctx.channel == msg.channel
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
+        if await can_announce(ctx):
             content_msg = await ctx.channel.send(embed=generate_embed('What would be the content of the embed?(Must be within 2048 characters)'))
             try:
                 content = await self.bot.wait_for("message", check=check, timeout=300.0)
@@ -705,12 +849,10 @@ class Announcement(commands.Cog):
             except asyncio.TimeoutError:
                 await time_msg.delete()
                 return await ctx.send("Cancelled the session as it's inactive!")
-            announcement_id = generate_id()
-            await self.bot.pool.execute("INSERT INTO timed_raw_announcements(announcement_id, channel_id, content, expires) VALUES($1, $2, $3, $4);", announcement_id, channel.id, content.content, parsed_time)
-            await self.bot.pool.execute("INSERT INTO timed_raw_announcement_backups(announcement_id, channel_id, content, expires) VALUES($1, $2, $3, $4);", announcement_id, channel.id, content.content, parsed_time)
-            await self.bot.cache.cache_timed_raw_announcements()
-            await self.bot.cache.list_timed_raw_announcements()
-            await self.bot.cache.cache_timed_raw_announcement_backups()
+            announcement_id = await self.bot.pool.allocate_announcement_id()
+            async with self.bot.pool.unit_of_work() as unit:
+                unit.insert_announcement(announcement_id, ctx.guild.id, channel.id, "raw", content=content.content, expires=parsed_time)
+            self.bot.cache.apply_committed(unit)
             return await ctx.reply(f":thumbsup: | Your announcement has been successfully added to the queue! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore timedRaw {announcement_id}`.")
         else:
             return await ctx.send("You don't have permissions to use this command!")
@@ -719,14 +861,9 @@ class Announcement(commands.Cog):
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def raw(self, ctx, channel: discord.TextChannel):
         """Interactively creates a raw announcement!"""
-        allowed = await check_allowed(ctx)
         def check(msg: discord.Message):
                 return ctx.author == msg.author and ctx.channel == msg.channel
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
+        if await can_announce(ctx):
             content_msg = await ctx.channel.send(embed=generate_embed('What would be the content of the embed?(Must be within 2048 characters)'))
             try:
                 content = await self.bot.wait_for("message", check=check, timeout=300.0)
@@ -735,11 +872,12 @@ class Announcement(commands.Cog):
                 elif len(content.content) >= 2048:
                     return await ctx.send("Content is too long, must be within 2048 characters!")
                 await content_msg.delete()
-                announcement_id = generate_id()
-                await self.bot.pool.execute("INSERT INTO raw_announcements(announcement_id, channel_id, content) VALUES($1, $2, $3);", announcement_id, channel.id, content.content.strip())
-                await self.bot.cache.cache_raw_announcements()
+                announcement_id = await self.bot.pool.allocate_announcement_id()
+                async with self.bot.pool.unit_of_work() as unit:
+                    unit.insert_announcement(announcement_id, ctx.guild.id, channel.id, "raw", content=content.content.strip())
+                self.bot.cache.apply_committed(unit)
                 await ctx.reply(f":thumbsup: | Your announcement has been successfully posted! If you would like to restore this announcement, please use the following command `{ctx.prefix}restore timedRaw {announcement_id}`.")
-                await channel.send(content.content)
+                await self.bot.delivery.send(channel, content=content.content)
             except asyncio.TimeoutError:
                 await content_msg.delete()
                 return await ctx.send("Cancelled as the session is inactive!")
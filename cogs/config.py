@@ -11,6 +11,11 @@ class Config(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    def allowed_roles(self, guild_id):
+        """The allowed roles of a guild, `None` if it has none or no `settings` record yet"""
+        setting = self.bot.cache.get_setting(guild_id)
+        return setting.allowed_roles if setting is not None else None
+
     @commands.group(invoke_without_command=True)
     @commands.has_permissions(administrator=True)
     async def config(self, ctx):
@@ -25,15 +30,9 @@ class Config(commands.Cog):
             return await ctx.reply(
                 ":negative_squared_cross_mark: | The prefix must be within 3 characters!"
             )
-        await self.bot.pool.execute(
-            "UPDATE settings SET prefix = $1 WHERE guild_id = $2", prefix, ctx.guild.id
-        )
+        record = await self.bot.pool.update_prefix(ctx.guild.id, prefix)
         # updating the cache
-        guild = self.bot.cache.get_setting(ctx.guild.id)
-        self.bot.cache.settings[ctx.guild.id] = {
-            "prefix": prefix,
-            "allowed_roles": guild["allowed_roles"],
-        }
+        self.bot.cache.upsert_setting(record)
         await ctx.reply(
             embed=generate_embed(
                 f":thumbsup: | Successfully changed the prefix to: `{prefix}`!",
@@ -44,21 +43,13 @@ class Config(commands.Cog):
     @config.command()
     async def addRole(self, ctx, role: discord.Role):
         """Enable specific roles for making announcements!"""
-        guild = self.bot.cache.get_setting(ctx.guild.id)
-        allowed_roles = guild.allowed_roles
+        allowed_roles = self.allowed_roles(ctx.guild.id)
         if not allowed_roles:
             roles = []
             roles.append(role.id)
-            await self.bot.pool.execute(
-                "UPDATE settings SET allowed_roles = $1 WHERE guild_id = $2",
-                roles,
-                ctx.guild.id,
-            )
+            record = await self.bot.pool.update_allowed_roles(ctx.guild.id, roles)
             # updating the cache
-            self.bot.cache.settings[ctx.guild.id] = {
-                "prefix": guild["prefix"],
-                "allowed_roles": roles,
-            }
+            self.bot.cache.upsert_setting(record)
             embed = generate_embed(
                 f":thumbsup: | Successfully added `{role.name}` to allowed roles list, now any person with `{role.name}` can make announcements!"
             )
@@ -72,17 +63,10 @@ class Config(commands.Cog):
             return await ctx.reply(
                 f":negative_squared_cross_mark: | `{role.name}` role  already has permissions to make announcements!"
             )
-        allowed_roles.append(role.id)
-        await self.bot.pool.execute(
-            "UPDATE settings SET allowed_roles = $1 WHERE guild_id = $2",
-            allowed_roles,
-            ctx.guild.id,
-        )
+        allowed_roles = allowed_roles + [role.id]
+        record = await self.bot.pool.update_allowed_roles(ctx.guild.id, allowed_roles)
         # updating the cache
-        self.bot.cache.settings[ctx.guild.id] = {
-            "prefix": guild["prefix"],
-            "allowed_roles": allowed_roles,
-        }
+        self.bot.cache.upsert_setting(record)
         embed = generate_embed(
             f":thumbsup: | Successfully added `{role.name}` to allowed roles list, now any person with `{role.name}` role can make announcements!"
         )
@@ -95,8 +79,7 @@ class Config(commands.Cog):
     @config.command()
     async def remRole(self, ctx, role: discord.Role):
         """Removes permissions for active roles to make announcements."""
-        guild = self.bot.cache.get_setting(ctx.guild.id)
-        allowed_roles = guild.allowed_roles
+        allowed_roles = self.allowed_roles(ctx.guild.id)
         if not allowed_roles:
             return await ctx.reply(
                 f":negative_squared_cross_mark: | You haven't added any roles to make announcements yet, to add a role use: `{ctx.prefix}config addRole <role>`!"
@@ -105,17 +88,10 @@ class Config(commands.Cog):
             return await ctx.reply(
                 f":negative_squared_cross_mark: | `{role.name}` doesn't exist in the allowed roles list!"
             )
-        allowed_roles.remove(role.id)
-        await self.bot.pool.execute(
-            "UPDATE settings SET allowed_roles = $1 WHERE guild_id = $2",
-            allowed_roles,
-            ctx.guild.id,
-        )
+        allowed_roles = [role_id for role_id in allowed_roles if role_id != role.id]
+        record = await self.bot.pool.update_allowed_roles(ctx.guild.id, allowed_roles)
         # updating the cache
-        self.bot.cache.settings[ctx.guild.id] = {
-            "prefix": guild["prefix"],
-            "allowed_roles": allowed_roles,
-        }
+        self.bot.cache.upsert_setting(record)
         embed = generate_embed(
             f":thumbsup: | Successfully removed `{role.name}` from allowed roles list, now any person with `{role.name}` role cannot able make announcements!"
         )
@@ -128,8 +104,7 @@ class Config(commands.Cog):
     @config.command()
     async def roleList(self, ctx):
         """Replys the allowed roles list"""
-        guild = self.bot.cache.get_setting(ctx.guild.id)
-        allowed_roles = guild.allowed_roles
+        allowed_roles = self.allowed_roles(ctx.guild.id)
         if not allowed_roles:
             return await ctx.reply(
                 f":negative_squared_cross_mark: | You haven't added any roles to make announcements yet, to add a role use: `{ctx.prefix}config addRole <role>`!"
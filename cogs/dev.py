@@ -1,17 +1,18 @@
 # -*- coding: utf-8 -*-
 
-import os
-
 import discord
 from discord.ext import commands
 
+from utils.backup import BackupError, dump_database, format_size, rotate_backups
 from utils.utlities import generate_embed
 
+# attachment size limit outside of boosted guilds
+UPLOAD_LIMIT = 8 * 1024 * 1024
+
 
 class Dev(commands.Cog, command_attrs=dict(hidden=True)):
     def __init__(self, bot):
         self.bot = bot
-        self.backup_index = 0
 
     @commands.is_owner()
     @commands.group(aliases=["bl"], invoke_without_command=True)
@@ -22,18 +23,22 @@ class Dev(commands.Cog, command_attrs=dict(hidden=True)):
     @blacklist.command()
     async def add(self, ctx, guild_id: int, *, reason):
         """Add the given guild id to blacklist"""
+        await self.bot.blacklist.add(guild_id, reason)
         guild = self.bot.get_guild(guild_id)
         if guild:
-            self.bot.blacklist.add(guild_id)
             await guild.leave()
             return await ctx.reply(
                 f":thumbsup: | Successfully blacklisted {guild.name} reason being: `{reason}`"
             )
+        await ctx.reply(
+            f":thumbsup: | Successfully blacklisted guild(`ID: {guild_id}`) reason being: `{reason}`"
+        )
 
     @blacklist.command()
     async def remove(self, ctx, guild_id: int):
         """Remove the given guild id from blacklist"""
-        self.bot.blacklist.remove(guild_id)
+        if not await self.bot.blacklist.remove(guild_id):
+            return await ctx.reply(f":x: | Guild(`ID: {guild_id}`) isn't blacklisted")
         return await ctx.reply(
             f":thumbsup: | Successfully un-blacklisted guild(`ID: {guild_id}`)"
         )
@@ -42,12 +47,10 @@ class Dev(commands.Cog, command_attrs=dict(hidden=True)):
     async def list(self, ctx):
         """Show the list of blacklisted Guild ID'S"""
         desc = ""
-        index = 1
-        if len(self.bot.blacklist._cache) == 0:
-            return await ctx.send("Blacklist data file is empty.")
-        for guild in self.bot.blacklist._cache:
-            desc += f"#{index} - {guild}"
-            index += 1
+        if len(self.bot.blacklist) == 0:
+            return await ctx.send("Blacklist is empty.")
+        for index, guild in enumerate(self.bot.blacklist, start=1):
+            desc += f"#{index} - {guild}\n"
         embed = generate_embed(desc)
         await ctx.send(embed=embed)
 
@@ -55,10 +58,58 @@ class Dev(commands.Cog, command_attrs=dict(hidden=True)):
     @commands.is_owner()
     async def backup(self, ctx):
         """Backup the postgresql records"""
-        self.backup_index += 1
-        os.system(f'pg_dump --dbname={self.bot.config.dsn} -F c -b -v -f backups/00{self.backup_index}.backup')
-        file = discord.File(fp=f'backups/00{self.backup_index}.backup')
-        await ctx.send(file=file)
+        status = await ctx.reply(":hourglass: | Backing up the database...")
+
+        async def progress(dumped, compressed):
+            await status.edit(
+                content=f":hourglass: | Backing up the database... `{format_size(dumped)}` dumped, `{format_size(compressed)}` written"
+            )
+
+        try:
+            path, size = await dump_database(self.bot.config.dsn, progress=progress)
+        except (BackupError, OSError) as e:
+            return await status.edit(content=f":x: | Backup failed: `{str(e)[:1800]}`")
+        rotate_backups()
+
+        limit = ctx.guild.filesize_limit if ctx.guild else UPLOAD_LIMIT
+        if size > limit:
+            return await status.edit(
+                content=f":thumbsup: | Backup saved to `{path}` (`{format_size(size)}`), it's too large to upload"
+            )
+        await status.edit(content=f":thumbsup: | Backup saved to `{path}` (`{format_size(size)}`)")
+        await ctx.send(file=discord.File(fp=path))
+
+    @commands.command()
+    @commands.is_owner()
+    async def deliveries(self, ctx):
+        """Show the delivery queue depth"""
+        desc = f"Queued messages: `{self.bot.delivery.depth}`\n"
+        for channel_id, depth in self.bot.delivery.busiest():
+            desc += f"<#{channel_id}> - `{depth}`\n"
+        await ctx.send(embed=generate_embed(desc))
+
+    @commands.command()
+    @commands.is_owner()
+    async def cachestats(self, ctx):
+        """Show the internal cache hit and miss counts"""
+        stats = self.bot.cache.stats()
+        desc = f"Mode: `{stats['mode']}`\n"
+        for table in ("settings", "announcements"):
+            hits, misses = stats["hits"][table], stats["misses"][table]
+            ratio = hits / (hits + misses) * 100 if hits + misses else 0
+            desc += f"`{table}` - hits: `{hits}`, misses: `{misses}`, hit ratio: `{ratio:.1f}%`\n"
+        desc += f"Cached settings: `{stats['settings']}`\n"
+        desc += f"Pinned announcements: `{stats['pinned_announcements']}`\n"
+        if stats["mode"] == "lazy":
+            desc += f"Recent announcements: `{stats['recent_announcements']}/{stats['max_announcements']}`, evicted: `{stats['evictions']}`\n"
+        await ctx.send(embed=generate_embed(desc))
+
+    @commands.command()
+    @commands.is_owner()
+    async def resync(self, ctx):
+        """Reload the internal cache from postgres"""
+        await self.bot.cache.resync()
+        await ctx.reply(":thumbsup: | Successfully resynced the internal cache")
 
 
 def setup(bot):
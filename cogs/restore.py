@@ -3,7 +3,7 @@
 import discord
 from discord.ext import commands
 
-from utils.utlities import check_allowed
+from utils.utlities import can_announce
 
 
 class Backup(commands.Cog):
@@ -12,6 +12,23 @@ class Backup(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def restore_announcement(self, ctx, announcement_id: int, kind: str):
+        """Re-post a saved announcement of the given kind and remove it from the database"""
+        announcement = await self.bot.cache.get_announcement(announcement_id, kind=kind)
+        if not announcement or announcement.guild_id not in (None, ctx.guild.id):
+            return await ctx.reply("Announcement not found!")
+        channel = self.bot.get_channel(announcement.channel_id)
+        # scheduled announcements are still posted when they're due, in-flight ones are being posted by a worker
+        if announcement.status not in ("scheduled", "in_flight"):
+            async with self.bot.pool.unit_of_work() as unit:
+                unit.delete_announcement(announcement_id)
+            self.bot.cache.apply_committed(unit)
+        if kind == "embed":
+            await self.bot.delivery.send(channel, embed=discord.Embed.from_dict(announcement.embed_details))
+        else:
+            await self.bot.delivery.send(channel, content=announcement.content)
+        await ctx.reply(f":thumbsup: | Your announcment(#`{announcement_id}`) has been restored successfully!")
+
     @commands.group(invoke_without_command=True)
     async def restore(self, ctx):
         """Parent command, sends the list of subcommands!"""
@@ -21,81 +38,29 @@ class Backup(commands.Cog):
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def quick(self, ctx, announcement_id: int):
         """Command that restores saved announcements"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
-            announcement = self.bot.cache.get_announcement(announcement_id)
-            if not announcement:
-                return await ctx.reply("Announcement not found!")
-            embed = discord.Embed.from_dict(announcement.embed_details)
-            channel = self.bot.get_channel(announcement.channel_id)
-            await self.bot.pool.execute("DELETE FROM announcements WHERE announcement_id = $1", announcement_id)
-            await self.bot.cache.cache_announcements()
-            await channel.send(embed=embed)
-            await ctx.reply(f":thumbsup: | Your announcment(#`{announcement_id}`) has been restored successfully!")
+        if await can_announce(ctx):
+            await self.restore_announcement(ctx, announcement_id, "embed")
 
     @restore.command()
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def timed(self, ctx, announcement_id: int):
         """Command that restores saved timed announcements"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
-            announcement = self.bot.cache.get_timed_announcement(announcement_id)
-            if not announcement:
-                return await ctx.reply("Announcement not found!")
-            content = announcement.content
-            channel = self.bot.get_channel(announcement.channel_id)
-            await self.bot.pool.execute("DELETE FROM timed_announcement_backups WHERE announcement_id = $1", announcement_id)
-            await self.bot.cache.cache_backup_timed_announcements()
-            await channel.send(content)
-            await ctx.reply(f":thumbsup: | Your announcment(#`{announcement_id}`) has been restored successfully!")
+        if await can_announce(ctx):
+            await self.restore_announcement(ctx, announcement_id, "embed")
 
     @restore.command()
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def timedRaw(self, ctx, announcement_id: int):
         """Command that restores saved time raw announcements"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
-            announcement = self.bot.cache.get_timed_raw_announcement(announcement_id)
-            if not announcement:
-                return await ctx.reply("Announcement not found!")
-            content = announcement.content
-            channel = self.bot.get_channel(announcement.channel_id)
-            await self.bot.pool.execute("DELETE FROM timed_raw_announcement_backups WHERE announcement_id = $1", announcement_id)
-            await self.bot.cache.cache_timed_raw_announcement_backups()
-            await channel.send(content)
-            await ctx.reply(f":thumbsup: | Your announcment(#`{announcement_id}`) has been restored successfully!")
+        if await can_announce(ctx):
+            await self.restore_announcement(ctx, announcement_id, "raw")
 
     @restore.command()
     @commands.max_concurrency(1, commands.BucketType.guild)
     async def raw(self, ctx, announcement_id: int):
         """Command that restores saved raw announcements"""
-        allowed = await check_allowed(ctx)
-        if (
-            ctx.author == ctx.guild.owner
-            or ctx.author.guild_permissions.administrator
-            or allowed
-        ):
-            announcement = self.bot.cache.get_raw_announcement(announcement_id)
-            if not announcement:
-                return await ctx.reply("Announcement not found!")
-            content = announcement.content
-            channel = self.bot.get_channel(announcement.channel_id)
-            await self.bot.pool.execute("DELETE FROM raw_announcements WHERE announcement_id = $1", announcement_id)
-            await self.bot.cache.cache_raw_announcements()
-            await channel.send(content)
-            await ctx.reply(f":thumbsup: | Your announcment(#`{announcement_id}`) has been restored successfully!")
+        if await can_announce(ctx):
+            await self.restore_announcement(ctx, announcement_id, "raw")
 
 def setup(bot):
     bot.add_cog(Backup(bot))
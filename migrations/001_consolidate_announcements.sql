@@ -0,0 +1,67 @@
+-- Folds the six announcement tables into a single `announcements` table with
+-- `kind` and `status` columns. Rows coming from the old tables have no
+-- `guild_id` since it was never stored, new rows always carry one.
+
+ALTER TABLE announcements
+    ADD COLUMN guild_id BIGINT,
+    ADD COLUMN kind TEXT NOT NULL DEFAULT 'embed' CHECK (kind IN ('embed', 'raw')),
+    ADD COLUMN status TEXT NOT NULL DEFAULT 'sent' CHECK (status IN ('scheduled', 'sent', 'cancelled')),
+    ADD COLUMN content TEXT,
+    ADD COLUMN expires TIMESTAMPTZ,
+    ALTER COLUMN embed_details DROP NOT NULL;
+
+ALTER TABLE announcements ALTER COLUMN kind DROP DEFAULT;
+
+-- The old tables each had their own UNIQUE constraint, so the same ID may
+-- exist in more than one of them. Colliding rows get a fresh ID above the
+-- current maximum instead of being dropped.
+CREATE TEMPORARY TABLE legacy_announcements ON COMMIT DROP AS
+    SELECT announcement_id, channel_id, 'raw' AS kind, 'sent' AS status, NULL::JSONB AS embed_details, content, NULL::TIMESTAMPTZ AS expires
+    FROM raw_announcements
+    UNION ALL
+    SELECT announcement_id, channel_id, 'embed', 'scheduled', embed_details, NULL, expires
+    FROM timed_announcements
+    UNION ALL
+    SELECT announcement_id, channel_id, 'embed', 'sent', embed_details, NULL, expires
+    FROM timed_announcement_backups b
+    WHERE NOT EXISTS (SELECT 1 FROM timed_announcements t WHERE t.announcement_id = b.announcement_id)
+    UNION ALL
+    SELECT announcement_id, channel_id, 'raw', 'scheduled', NULL, content, expires
+    FROM timed_raw_announcements
+    UNION ALL
+    SELECT announcement_id, channel_id, 'raw', 'sent', NULL, content, expires
+    FROM timed_raw_announcement_backups b
+    WHERE NOT EXISTS (SELECT 1 FROM timed_raw_announcements t WHERE t.announcement_id = b.announcement_id);
+
+INSERT INTO announcements(announcement_id, channel_id, kind, status, embed_details, content, expires)
+    SELECT DISTINCT ON (l.announcement_id) l.announcement_id, l.channel_id, l.kind, l.status, l.embed_details, l.content, l.expires
+    FROM legacy_announcements l
+    WHERE NOT EXISTS (SELECT 1 FROM announcements a WHERE a.announcement_id = l.announcement_id)
+    ORDER BY l.announcement_id, l.status = 'scheduled' DESC;
+
+INSERT INTO announcements(announcement_id, channel_id, kind, status, embed_details, content, expires)
+    SELECT (SELECT MAX(announcement_id) FROM announcements) + ROW_NUMBER() OVER (), l.channel_id, l.kind, l.status, l.embed_details, l.content, l.expires
+    FROM legacy_announcements l
+    WHERE NOT EXISTS (
+        SELECT 1 FROM announcements a
+        WHERE a.announcement_id = l.announcement_id
+            AND a.kind = l.kind
+            AND a.status = l.status
+            AND a.channel_id = l.channel_id
+            AND a.expires IS NOT DISTINCT FROM l.expires
+    );
+
+ALTER TABLE announcements
+    ADD CHECK (kind <> 'embed' OR embed_details IS NOT NULL),
+    ADD CHECK (kind <> 'raw' OR content IS NOT NULL),
+    ADD CHECK (status <> 'scheduled' OR expires IS NOT NULL);
+
+CREATE INDEX IF NOT EXISTS announcements_scheduled_idx ON announcements (expires) WHERE status = 'scheduled';
+
+CREATE INDEX IF NOT EXISTS announcements_guild_idx ON announcements (guild_id, announcement_id) WHERE status <> 'cancelled';
+
+DROP TABLE raw_announcements;
+DROP TABLE timed_announcements;
+DROP TABLE timed_announcement_backups;
+DROP TABLE timed_raw_announcements;
+DROP TABLE timed_raw_announcement_backups;
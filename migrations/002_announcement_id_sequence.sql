@@ -0,0 +1,6 @@
+-- Replaces random 4 digit IDs with blocks reserved from a sequence, new IDs
+-- continue after the largest existing one so they never collide.
+
+CREATE SEQUENCE IF NOT EXISTS announcement_ids INCREMENT BY 50 MINVALUE 1000 START WITH 1000;
+
+SELECT setval('announcement_ids', GREATEST(1000, (SELECT MAX(announcement_id) + 1 FROM announcements)), false);
@@ -0,0 +1,28 @@
+-- Publishes the key of every changed row on the `announcer_changes` channel so
+-- other processes can update their cache. The key column is the trigger argument.
+CREATE OR REPLACE FUNCTION notify_announcer_change() RETURNS trigger AS $$
+DECLARE
+    changed JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := to_jsonb(OLD);
+    ELSE
+        changed := to_jsonb(NEW);
+    END IF;
+    PERFORM pg_notify('announcer_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'key', changed -> TG_ARGV[0],
+        'guild_id', changed -> 'guild_id'
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS settings_notify ON settings;
+CREATE TRIGGER settings_notify AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('guild_id');
+
+DROP TRIGGER IF EXISTS announcements_notify ON announcements;
+CREATE TRIGGER announcements_notify AFTER INSERT OR UPDATE OR DELETE ON announcements
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('announcement_id');
@@ -0,0 +1,10 @@
+-- Lets several workers share the delivery queue: due rows are leased with
+-- FOR UPDATE SKIP LOCKED and marked `in_flight` until the lease expires.
+
+ALTER TABLE announcements
+    ADD COLUMN lease_owner TEXT,
+    ADD COLUMN lease_expires TIMESTAMPTZ,
+    DROP CONSTRAINT announcements_status_check,
+    ADD CONSTRAINT announcements_status_check CHECK (status IN ('scheduled', 'in_flight', 'sent', 'cancelled'));
+
+CREATE INDEX IF NOT EXISTS announcements_leased_idx ON announcements (lease_expires) WHERE status = 'in_flight';
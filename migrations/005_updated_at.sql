@@ -0,0 +1,25 @@
+-- Stamps every row with the time it last changed so a restarted process can
+-- load its cache snapshot and only fetch rows changed since the snapshot.
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE settings ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+ALTER TABLE announcements ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS settings_updated_idx ON settings (updated_at);
+
+CREATE INDEX IF NOT EXISTS announcements_updated_idx ON announcements (updated_at);
+
+DROP TRIGGER IF EXISTS settings_touch ON settings;
+CREATE TRIGGER settings_touch BEFORE UPDATE ON settings
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS announcements_touch ON announcements;
+CREATE TRIGGER announcements_touch BEFORE UPDATE ON announcements
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
@@ -0,0 +1,13 @@
+-- Moves the guild blacklist from data/blacklist.json into postgres, every change is
+-- published on `announcer_changes` so other processes update their cached set.
+-- `cli.py migrate` imports the entries of data/blacklist.json after this runs.
+
+CREATE TABLE IF NOT EXISTS blacklist(
+    guild_id BIGINT NOT NULL PRIMARY KEY,
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+DROP TRIGGER IF EXISTS blacklist_notify ON blacklist;
+CREATE TRIGGER blacklist_notify AFTER INSERT OR UPDATE OR DELETE ON blacklist
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('guild_id');
@@ -1,60 +1,105 @@
 DROP TABLE IF EXISTS settings;
 DROP TABLE IF EXISTS announcements;
-DROP TABLE IF EXISTS raw_announcements;
-DROP TABLE IF EXISTS timed_announcements;
-DROP TABLE IF EXISTS timed_announcement_backups;
-DROP TABLE IF EXISTS timed_raw_announcements;
-DROP TABLE IF EXISTS timed_raw_announcement_backups;
+DROP TABLE IF EXISTS blacklist;
+DROP TABLE IF EXISTS schema_migrations;
+DROP SEQUENCE IF EXISTS announcement_ids;
 
 CREATE TABLE IF NOT EXISTS settings(
     id BIGSERIAL NOT NULL PRIMARY KEY,
     guild_id BIGINT NOT NULL UNIQUE,
     allowed_roles BIGINT[] NOT NULL,
-    prefix TEXT NOT NULL DEFAULT 'a!'
+    prefix TEXT NOT NULL DEFAULT 'a!',
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
-CREATE TABLE IF NOT EXISTS timed_announcements(
-    id BIGSERIAL NOT NULL PRIMARY KEY,
-    announcement_id INTEGER NOT NULL UNIQUE,
-    expires TIMESTAMPTZ NOT NULL,
-    channel_id BIGINT NOT NULL,
-    embed_details JSONB NOT NULL
-);
+CREATE INDEX IF NOT EXISTS settings_updated_idx ON settings (updated_at);
+
+-- every nextval reserves a block of `INCREMENT BY` IDs which the bot hands out from memory
+CREATE SEQUENCE IF NOT EXISTS announcement_ids INCREMENT BY 50 MINVALUE 1000 START WITH 1000;
 
 CREATE TABLE IF NOT EXISTS announcements(
     id BIGSERIAL NOT NULL PRIMARY KEY,
     announcement_id INTEGER NOT NULL UNIQUE,
+    guild_id BIGINT,
     channel_id BIGINT NOT NULL,
-    embed_details JSONB NOT NULL
+    kind TEXT NOT NULL CHECK (kind IN ('embed', 'raw')),
+    status TEXT NOT NULL DEFAULT 'sent' CHECK (status IN ('scheduled', 'in_flight', 'sent', 'cancelled')),
+    embed_details JSONB,
+    content TEXT,
+    expires TIMESTAMPTZ,
+    lease_owner TEXT,
+    lease_expires TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    CHECK (kind <> 'embed' OR embed_details IS NOT NULL),
+    CHECK (kind <> 'raw' OR content IS NOT NULL),
+    CHECK (status <> 'scheduled' OR expires IS NOT NULL)
 );
 
-CREATE TABLE IF NOT EXISTS raw_announcements(
-    id BIGSERIAL NOT NULL PRIMARY KEY,
-    announcement_id INTEGER NOT NULL UNIQUE,
-    channel_id BIGINT NOT NULL,
-    content TEXT NOT NULL
-);
+CREATE INDEX IF NOT EXISTS announcements_scheduled_idx ON announcements (expires) WHERE status = 'scheduled';
 
-CREATE TABLE IF NOT EXISTS timed_raw_announcements(
-    id BIGSERIAL NOT NULL PRIMARY KEY,
-    announcement_id INTEGER NOT NULL UNIQUE,
-    expires TIMESTAMPTZ NOT NULL,
-    channel_id BIGINT NOT NULL,
-    content TEXT NOT NULL
-);
+CREATE INDEX IF NOT EXISTS announcements_leased_idx ON announcements (lease_expires) WHERE status = 'in_flight';
 
-CREATE TABLE IF NOT EXISTS timed_raw_announcement_backups(
-    id BIGSERIAL NOT NULL PRIMARY KEY,
-    announcement_id INTEGER NOT NULL UNIQUE,
-    expires TIMESTAMPTZ NOT NULL,
-    channel_id BIGINT NOT NULL,
-    content TEXT NOT NULL
+CREATE INDEX IF NOT EXISTS announcements_guild_idx ON announcements (guild_id, announcement_id) WHERE status <> 'cancelled';
+
+CREATE INDEX IF NOT EXISTS announcements_updated_idx ON announcements (updated_at);
+
+-- Publishes the key of every changed row on the `announcer_changes` channel so
+-- other processes can update their cache. The key column is the trigger argument.
+CREATE OR REPLACE FUNCTION notify_announcer_change() RETURNS trigger AS $$
+DECLARE
+    changed JSONB;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := to_jsonb(OLD);
+    ELSE
+        changed := to_jsonb(NEW);
+    END IF;
+    PERFORM pg_notify('announcer_changes', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'key', changed -> TG_ARGV[0],
+        'guild_id', changed -> 'guild_id'
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS settings_notify ON settings;
+CREATE TRIGGER settings_notify AFTER INSERT OR UPDATE OR DELETE ON settings
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('guild_id');
+
+DROP TRIGGER IF EXISTS announcements_notify ON announcements;
+CREATE TRIGGER announcements_notify AFTER INSERT OR UPDATE OR DELETE ON announcements
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('announcement_id');
+
+-- Stamps every row with the time it last changed, restarted processes only
+-- fetch rows changed since their cache snapshot.
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS settings_touch ON settings;
+CREATE TRIGGER settings_touch BEFORE UPDATE ON settings
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+DROP TRIGGER IF EXISTS announcements_touch ON announcements;
+CREATE TRIGGER announcements_touch BEFORE UPDATE ON announcements
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
+CREATE TABLE IF NOT EXISTS blacklist(
+    guild_id BIGINT NOT NULL PRIMARY KEY,
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
 );
 
-CREATE TABLE IF NOT EXISTS timed_announcement_backups(
-    id BIGSERIAL NOT NULL PRIMARY KEY,
-    announcement_id INTEGER NOT NULL UNIQUE,
-    expires TIMESTAMPTZ NOT NULL,
-    channel_id BIGINT NOT NULL,
-    embed_details JSONB NOT NULL
-);
\ No newline at end of file
+DROP TRIGGER IF EXISTS blacklist_notify ON blacklist;
+CREATE TRIGGER blacklist_notify AFTER INSERT OR UPDATE OR DELETE ON blacklist
+    FOR EACH ROW EXECUTE FUNCTION notify_announcer_change('guild_id');
+
+CREATE TABLE IF NOT EXISTS schema_migrations(
+    name TEXT NOT NULL PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
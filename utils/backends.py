@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Union
+
+import orjson
+
+# number of hash fields written per HSET while storing a whole table
+STORE_CHUNK_SIZE = 1000
+
+
+class CacheBackend(ABC):
+    """Storage the internal cache persists its tables to
+
+    Rows are plain dicts keyed on the table's primary key. `persistent` backends outlive the
+    process, so the cache can be warmed from them instead of postgres.
+    """
+
+    persistent = False
+
+    @abstractmethod
+    async def load(self, table: str) -> Union[Dict[int, dict], None]:
+        """Load every row of a table, returns `None` if the table was never fully stored
+
+        Parameters
+        ----------
+        table: str
+            The table to load
+        """
+
+    @abstractmethod
+    async def store(self, table: str, rows: Dict[int, dict], replace: bool = True) -> None:
+        """Store many rows of a table at once
+
+        Parameters
+        ----------
+        table: str
+            The table to store
+        rows: Dict[int, dict]
+            The rows keyed on their primary key
+        replace: bool
+            Whether the rows are the whole table, other rows are only kept if it's `False`
+        """
+
+    @abstractmethod
+    async def set(self, table: str, key: int, row: dict) -> None:
+        """Insert or replace a row"""
+
+    @abstractmethod
+    async def delete(self, table: str, key: int) -> None:
+        """Delete a row if exists"""
+
+    async def load_watermark(self, table: str, scope: str) -> Union[datetime, None]:
+        """Latest `updated_at` the stored table is known to be in sync with, `None` if it's unknown
+
+        Parameters
+        ----------
+        table: str
+            The table the watermark belongs to
+        scope: str
+            Which rows it covers, processes running a subset of shards keep their own watermark
+        """
+        return None
+
+    async def store_watermark(self, table: str, scope: str, watermark: datetime) -> None:
+        """Store the watermark of a table, see `load_watermark`"""
+
+    async def close(self) -> None:
+        """Release the resources held by the backend"""
+
+
+class MemoryBackend(CacheBackend):
+    """In-process backend, the cache's own dicts are the only copy so nothing is stored"""
+
+    async def load(self, table: str) -> None:
+        return None
+
+    async def store(self, table: str, rows: Dict[int, dict], replace: bool = True) -> None:
+        pass
+
+    async def set(self, table: str, key: int, row: dict) -> None:
+        pass
+
+    async def delete(self, table: str, key: int) -> None:
+        pass
+
+
+class RedisBackend(CacheBackend):
+    """Redis backend keeping a hash per table, shared by every process using the same server
+
+    A table is only loaded once a full copy of it was stored, which is marked by
+    the `<namespace>:<table>:warm` key. `<namespace>:<table>:watermark:<scope>` holds the
+    `updated_at` the copy is in sync with, rows changed after it are fetched from postgres.
+
+    Parameters
+    ----------
+    url: str
+        The redis server URL, e.g. `redis://localhost:6379/0`
+    namespace: str
+        Prefix of every key the backend uses
+    """
+
+    persistent = True
+
+    def __init__(self, url: str, namespace: str = "announcer"):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            # not pinned in requirements.txt, its async-timeout requirement conflicts with the aiohttp discord.py pins
+            raise RuntimeError("The redis cache backend requires the `redis` package (4.2 or newer)") from None
+        self.namespace = namespace
+        self.redis = aioredis.from_url(url)
+
+    def _key(self, table: str) -> str:
+        return f"{self.namespace}:{table}"
+
+    async def load(self, table: str) -> Union[Dict[int, dict], None]:
+        key = self._key(table)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(f"{key}:warm")
+            pipe.hgetall(key)
+            warm, rows = await pipe.execute()
+        if not warm:
+            return None
+        return {int(field): orjson.loads(value) for field, value in rows.items()}
+
+    async def store(self, table: str, rows: Dict[int, dict], replace: bool = True) -> None:
+        key = self._key(table)
+        items = [(str(field), orjson.dumps(row)) for field, row in rows.items()]
+        # a transaction, so other processes never load a half-written table
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if replace:
+                pipe.delete(key)
+            for index in range(0, len(items), STORE_CHUNK_SIZE):
+                pipe.hset(key, mapping=dict(items[index : index + STORE_CHUNK_SIZE]))
+            if replace:
+                pipe.set(f"{key}:warm", 1)
+            await pipe.execute()
+
+    async def load_watermark(self, table: str, scope: str) -> Union[datetime, None]:
+        watermark = await self.redis.get(f"{self._key(table)}:watermark:{scope}")
+        return datetime.fromisoformat(watermark.decode()) if watermark is not None else None
+
+    async def store_watermark(self, table: str, scope: str, watermark: datetime) -> None:
+        await self.redis.set(f"{self._key(table)}:watermark:{scope}", watermark.isoformat())
+
+    async def set(self, table: str, key: int, row: dict) -> None:
+        await self.redis.hset(self._key(table), str(key), orjson.dumps(row))
+
+    async def delete(self, table: str, key: int) -> None:
+        await self.redis.hdel(self._key(table), str(key))
+
+    async def close(self) -> None:
+        await self.redis.close()
+
+
+def create_backend(config) -> CacheBackend:
+    """Create the cache backend named by `cache_backend` in config.json, defaults to `memory`"""
+    name = getattr(config, "cache_backend", "memory")
+    if name == "memory":
+        return MemoryBackend()
+    if name == "redis":
+        return RedisBackend(getattr(config, "redis_url", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown cache backend: {name}")
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import time
+import zlib
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple, Union
+
+# directory backups are written to
+BACKUP_DIR = "backups"
+# number of backups kept, older ones are deleted after each successful backup
+KEEP_BACKUPS = 5
+# bytes read from pg_dump at a time
+CHUNK_SIZE = 1024 * 1024
+# seconds between two progress reports
+PROGRESS_INTERVAL = 2.0
+
+
+class BackupError(Exception):
+    """pg_dump exited with an error"""
+
+
+class _GzipWriter:
+    """Compresses chunks into a gzip file, its methods block so they're run in an executor"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        # wbits 31 writes a gzip header and trailer, so the file can be read with gunzip
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.size = 0
+
+    def write(self, chunk: bytes) -> int:
+        data = self.compressor.compress(chunk)
+        self.file.write(data)
+        self.size += len(data)
+        return self.size
+
+    def close(self) -> int:
+        data = self.compressor.flush()
+        self.file.write(data)
+        self.size += len(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        return self.size
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[str]:
+    """Paths of the backups in the directory, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".backup.gz")
+    )
+
+
+def rotate_backups(directory: str = BACKUP_DIR, keep: int = KEEP_BACKUPS) -> List[str]:
+    """Delete all but the `keep` newest backups, returns the deleted paths"""
+    deleted = list_backups(directory)[:-keep] if keep > 0 else list_backups(directory)
+    for path in deleted:
+        os.remove(path)
+    return deleted
+
+
+async def dump_database(
+    dsn: str,
+    directory: str = BACKUP_DIR,
+    progress: Callable[[int, int], Awaitable] = None,
+) -> Tuple[str, int]:
+    """Stream a `pg_dump` of the database into a gzip compressed file without blocking the event loop
+
+    The dump is written in pg_dump's custom format with its own compression turned off, so it's
+    compressed once. Compressing and writing run in an executor chunk by chunk. The file only gets
+    its final name once the dump succeeded. Restore it with `gunzip -c <file> | pg_restore -d <dsn>`.
+
+    Parameters
+    ----------
+    dsn: str
+        The database to dump
+    directory: str
+        Where the backup is written
+    progress: Callable[[int, int], Awaitable]
+        Awaited with the dumped and compressed byte counts every `PROGRESS_INTERVAL` seconds
+
+    Returns
+    -------
+    Tuple[str, int]
+        The path of the backup and its size in bytes
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"announcer-{datetime.utcnow():%Y%m%d-%H%M%S}.backup.gz")
+    temporary = f"{path}.part"
+
+    loop = asyncio.get_event_loop()
+    # opened before pg_dump is spawned, so failing to create the file leaves nothing running
+    writer = await loop.run_in_executor(None, _GzipWriter, temporary)
+    process = errors = None
+    dumped = compressed = 0
+    reported = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "pg_dump", f"--dbname={dsn}", "--format=custom", "--compress=0", "--blobs",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        # stderr is drained alongside stdout so a chatty pg_dump can't fill the pipe and stall
+        errors = asyncio.ensure_future(process.stderr.read())
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dumped += len(chunk)
+            compressed = await loop.run_in_executor(None, writer.write, chunk)
+            if progress is not None and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                reported = time.monotonic()
+                await progress(dumped, compressed)
+        compressed = await loop.run_in_executor(None, writer.close)
+        returncode = await process.wait()
+        stderr = await errors
+    except BaseException:
+        if process is not None and process.returncode is None:
+            process.kill()
+        if errors is not None:
+            errors.cancel()
+        writer.file.close()
+        os.remove(temporary)
+        raise
+
+    if returncode != 0:
+        os.remove(temporary)
+        raise BackupError(stderr.decode("utf-8", "replace").strip() or f"pg_dump exited with {returncode}")
+    os.replace(temporary, path)
+    return path, compressed
+
+
+def format_size(size: Union[int, float]) -> str:
+    """Human readable byte count"""
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
@@ -1,8 +1,183 @@
 # -*- coding: utf-8 -*-
 
-from typing import Union
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, FrozenSet, Union, List
 
-from .utlities import DottedDict
+from .backends import create_backend
+from .db import SettingsRecord, shard_id_for
+from .scheduler import Scheduler
+from .snapshot import read_snapshot, write_snapshot
+
+# prefix used by guilds without a `settings` record, mirrors the column default
+DEFAULT_PREFIX = "a!"
+# how often the cache is written to its snapshot file
+SNAPSHOT_INTERVAL = 300
+# rows stamped this long before the watermark are fetched again, covers transactions which committed late
+SNAPSHOT_MARGIN = timedelta(seconds=60)
+# watermark of a table loaded while it was empty, the next restore fetches every row
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# lazy mode: default number of unscheduled announcements kept in the LRU
+DEFAULT_MAX_ANNOUNCEMENTS = 10000
+# allowed roles of guilds without any, shared so lookups never allocate
+NO_ROLES = frozenset()
+
+
+class CachedSetting:
+    """A cached `settings` record"""
+
+    __slots__ = ("guild_id", "allowed_roles", "prefix")
+
+    def __init__(self, guild_id: int, allowed_roles: Union[List[int], None], prefix: str) -> None:
+        self.guild_id = guild_id
+        self.allowed_roles = allowed_roles
+        self.prefix = prefix
+
+    def to_row(self) -> dict:
+        """Serializable form stored in the cache backend"""
+        return {"guild_id": self.guild_id, "allowed_roles": self.allowed_roles, "prefix": self.prefix}
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """Build a cached record out of a row loaded from the cache backend"""
+        return cls(row["guild_id"], row["allowed_roles"], row["prefix"])
+
+    def __repr__(self) -> str:
+        return f"<CachedSetting guild_id={self.guild_id} allowed_roles={self.allowed_roles} prefix={self.prefix}>"
+
+
+class CachedAnnouncement:
+    """A cached `announcements` record"""
+
+    __slots__ = ("announcement_id", "guild_id", "channel_id", "kind", "status", "embed_details", "content", "expires")
+
+    def __init__(
+        self,
+        announcement_id: int,
+        guild_id: Union[int, None],
+        channel_id: int,
+        kind: str,
+        status: str,
+        embed_details: Union[dict, None],
+        content: Union[str, None],
+        expires: Union[datetime, None],
+    ) -> None:
+        self.announcement_id = announcement_id
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.kind = kind
+        self.status = status
+        self.embed_details = embed_details
+        self.content = content
+        self.expires = expires
+
+    @classmethod
+    def from_record(cls, record):
+        """Build a cached record out of an `AnnouncementRecord`"""
+        return cls(
+            record.announcement_id,
+            record.guild_id,
+            record.channel_id,
+            record.kind,
+            record.status,
+            record.embed_details,
+            record.content,
+            record.expires,
+        )
+
+    def to_row(self) -> dict:
+        """Serializable form stored in the cache backend"""
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """Build a cached record out of a row loaded from the cache backend"""
+        expires = row["expires"]
+        return cls(
+            row["announcement_id"],
+            row["guild_id"],
+            row["channel_id"],
+            row["kind"],
+            row["status"],
+            row["embed_details"],
+            row["content"],
+            datetime.fromisoformat(expires) if expires is not None else None,
+        )
+
+    def __repr__(self) -> str:
+        return f"<CachedAnnouncement announcement_id={self.announcement_id} kind={self.kind} status={self.status} channel_id={self.channel_id} expires={self.expires}>"
+
+
+def _write_snapshot_records(
+    path: str, header: dict, settings: List[CachedSetting], announcements: List[CachedAnnouncement]
+) -> int:
+    """Turn cached records into snapshot rows and write them, blocks so it's run in an executor"""
+    return write_snapshot(path, {
+        **header,
+        "settings": [[setting.guild_id, setting.allowed_roles, setting.prefix] for setting in settings],
+        "announcements": [
+            [getattr(announcement, slot) for slot in CachedAnnouncement.__slots__] for announcement in announcements
+        ],
+    })
+
+
+class MemberCache:
+    """Bounded LRU of members fetched over HTTP, used when the gateway member cache is disabled
+
+    Without the members intent no member updates arrive, so entries expire after `ttl` seconds
+    to pick up role changes.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of members kept
+    ttl: float
+        Seconds a fetched member is trusted for
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._members = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    async def fetch(self, guild, member_id: int):
+        """Retreive a member from the LRU, fetching it from discord on a miss
+
+        Parameters
+        ----------
+        guild: discord.Guild
+            The guild the member belongs to
+        member_id: int
+            The member ID to lookup
+        """
+        key = (guild.id, member_id)
+        cached = self._members.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self._members.move_to_end(key)
+            return cached[1]
+        member = await guild.fetch_member(member_id)
+        self._members[key] = (time.monotonic(), member)
+        self._members.move_to_end(key)
+        if len(self._members) > self.maxsize:
+            self._members.popitem(last=False)
+        return member
+
+    def evict_guild(self, guild_id: int):
+        """Forget every member of a guild
+
+        Parameters
+        ----------
+        guild_id: int
+            The guild ID to forget
+        """
+        for key in [key for key in self._members if key[0] == guild_id]:
+            del self._members[key]
 
 
 class Cache:
@@ -14,186 +189,526 @@ class Cache:
         self.bot = bot
         self.pool = bot.pool
         self.settings = {}
+        self.prefixes = {}
+        # allowed role IDs per guild, only guilds with allowed roles are indexed
+        self.role_index = {}
         self.announcements = {}
-        self.timed_announcements = {}
-        self.all_timed_announcements = []
-        self.backups = {}
-        self.raw_announcements = {}
-        self.timed_raw_announcements = {}
-        self.all_raw_ta = []
-        self.raw_backups = {}
+        self.scheduler = Scheduler()
+        self.backend = create_backend(bot.config)
+        # lazy mode keeps settings and scheduled announcements pinned in `settings` and `announcements`,
+        # other announcements are loaded on first access into a bounded LRU
+        self.lazy = getattr(bot.config, "cache_mode", "eager") == "lazy"
+        self.max_announcements = getattr(bot.config, "cache_max_announcements", DEFAULT_MAX_ANNOUNCEMENTS)
+        self._recent = OrderedDict()
+        self.hits = {"settings": 0, "announcements": 0}
+        self.misses = {"settings": 0, "announcements": 0}
+        self.evictions = 0
+        self._writes = deque()
+        self._writer = None
+        # whether the backend holds every cached row, the watermarks are only stored for it then
+        self._backend_synced = False
+        # tables the last warm-up read from the backend, they may miss changes made meanwhile
+        self._backend_loaded = set()
+        # set once a backend write failed, the stored watermarks aren't advanced past a lost write
+        self._write_failed = False
+        # only guilds on the shards of this process are cached when the bot runs a subset of shards
+        self.shards = None
+        if bot.shard_ids is not None and len(bot.shard_ids) < bot.shard_count:
+            self.shards = (bot.shard_count, sorted(bot.shard_ids))
+            self._shard_ids = frozenset(bot.shard_ids)
+        # latest `updated_at` cached per table, `None` while it's unknown (e.g. loaded from redis)
+        self.watermarks = {"settings": None, "announcements": None}
+        # rows the backend's watermarks cover, every process of a cluster keeps its own
+        self.scope = "all" if self.shards is None else f"{self.shards[1][0]}-{self.shards[1][-1]}"
+        self.snapshot_path = getattr(bot.config, "cache_snapshot", "data/cache.snapshot")
+        if self.snapshot_path and self.shards is not None:
+            # every process of a cluster keeps its own snapshot
+            root, ext = os.path.splitext(self.snapshot_path)
+            self.snapshot_path = f"{root}.{self.shards[1][0]}-{self.shards[1][-1]}{ext}"
+        self._snapshot_task = None
         self.log.info("Initialised postgres connection and prepared internal cache")
 
-    async def cache_settings(self):
-        """Retreive all records from `settings` table and cache it"""
-        records = await self.pool.fetch_all_settings()
-        del self.settings
-        self.settings = {}
-        for record in records:
-            self.settings[record.guild_id] = {
-                "allowed_roles": record.allowed_roles,
-                "prefix": record.prefix,
-            }
+    def owns_guild(self, guild_id: Union[int, None]) -> bool:
+        """Check if the guild belongs to the shards of this process, records without a guild belong to shard 0
+
+        Parameters
+        ----------
+        guild_id: Union[int, None]
+            The guild ID to check
+        """
+        if self.shards is None:
+            return True
+        shard_id = 0 if guild_id is None else shard_id_for(guild_id, self.shards[0])
+        return shard_id in self._shard_ids
+
+    def _persist(self, coro):
+        """Queue a backend write, writes run in the background one at a time so they're applied in order"""
+        self._writes.append(coro)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.ensure_future(self._drain_writes())
+
+    async def _drain_writes(self):
+        while self._writes:
+            try:
+                await self._writes.popleft()
+            except Exception as error:
+                self._write_failed = True
+                self.log.error(f"Cache backend write failed: {error!r}")
+
+    async def _load_rows(self, table: str, from_backend: bool):
+        """Load a table's rows and watermark from the cache backend, `None` if it's not persistent, cold or not wanted
+
+        A table without a watermark for this process' shards can't be brought up to date, so it's cold.
+        """
+        if not (from_backend and self.backend.persistent):
+            return None
+        rows, watermark = await asyncio.gather(
+            self.backend.load(table), self.backend.load_watermark(table, self.scope)
+        )
+        if rows is None or watermark is None:
+            return None
+        self.log.info(f"Loaded `{table}` from the {type(self.backend).__name__}")
+        self._backend_loaded.add(table)
+        return rows, watermark
+
+    async def _store_rows(self, table: str, cached: dict, complete: bool = True):
+        """Store a table loaded from postgres in the cache backend, sharded processes and partial loads only add their rows"""
+        if self.backend.persistent:
+            rows = {key: value.to_row() for key, value in cached.items()}
+            await self.backend.store(table, rows, replace=complete and self.shards is None)
+
+    async def cache_settings(self, from_backend: bool = False):
+        """Retreive all records from `settings` table and cache it
+
+        Parameters
+        ----------
+        from_backend: bool
+            Whether a warm cache backend is read instead of postgres
+        """
+        rows = await self._load_rows("settings", from_backend)
+        settings = {}
+        if rows is not None:
+            rows, watermark = rows
+            for row in rows.values():
+                if self.owns_guild(row["guild_id"]):
+                    settings[row["guild_id"]] = CachedSetting.from_row(row)
+        else:
+            # consumed page by page, so raw records never pile up during the load
+            watermark = EPOCH
+            async for records in self.pool.iter_settings(shards=self.shards):
+                for record in records:
+                    settings[record.guild_id] = CachedSetting(record.guild_id, record.allowed_roles, record.prefix)
+                    watermark = max(watermark, record.updated_at)
+        self.watermarks["settings"] = watermark
+        self.settings = settings
+        self.prefixes = {guild_id: setting.prefix for guild_id, setting in settings.items()}
+        self.role_index = self._index_roles(settings.values())
+        if rows is None:
+            await self._store_rows("settings", settings)
         return self.settings
 
-    async def cache_announcements(self):
-        """Retreive all records from `announcements` table and cache it"""
-        records = await self.pool.fetch_all_announcements()
-        del self.announcements
-        self.announcements = {}
-        for record in records:
-            self.announcements[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "embed_details": record.embed_details,
-            }
+    async def cache_announcements(self, from_backend: bool = False):
+        """Retreive all records from `announcements` table, cache it and schedule the scheduled ones
+
+        Only the scheduled records are retreived in lazy mode.
+
+        Parameters
+        ----------
+        from_backend: bool
+            Whether a warm cache backend is read instead of postgres
+        """
+        rows = await self._load_rows("announcements", from_backend)
+        announcements = {}
+        if rows is not None:
+            rows, watermark = rows
+            for row in rows.values():
+                if self.owns_guild(row["guild_id"]) and not (self.lazy and row["status"] != "scheduled"):
+                    announcements[row["announcement_id"]] = CachedAnnouncement.from_row(row)
+        else:
+            # consumed page by page, so raw records never pile up during the load
+            watermark = EPOCH
+            async for records in self.pool.iter_announcements(shards=self.shards, scheduled=self.lazy):
+                for record in records:
+                    announcements[record.announcement_id] = CachedAnnouncement.from_record(record)
+                    watermark = max(watermark, record.updated_at)
+        self.watermarks["announcements"] = watermark
+        self.announcements = announcements
+        self._recent = OrderedDict()
+        self.scheduler.replace(
+            announcement for announcement in self.announcements.values() if announcement.status == "scheduled"
+        )
+        if rows is None:
+            await self._store_rows("announcements", announcements, complete=not self.lazy)
         return self.announcements
 
-    async def cache_timed_announcements(self):
-        """Retreive all records from `timed_announcements` table and cache it"""
-        records = await self.pool.fetch_all_timed_announcements()
-        del self.timed_announcements
-        self.timed_announcements = {}
-        for record in records:
-            self.timed_announcements[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "embed_details": record.embed_details,
-                "expires": record.expires
-            }
-        return self.timed_announcements
-
-    async def list_timed_announcements(self):
-        """Retreive all records from `timed_announcements` table and cache it"""
-        records = await self.pool.fetch_all_timed_announcements()
-        self.all_timed_announcements = records
-
-    async def cache_backup_timed_announcements(self):
-        """Retreive all records from `timed_announcements` table and cache it"""
-        records = await self.pool.fetch_all_backup_announcements()
-        del self.backups
-        self.backups = {}
-        for record in records:
-            self.backups[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "embed_details": record.embed_details,
-                "expires": record.expires
-            }
-        return self.backups
-
-    async def cache_timed_raw_announcements(self):
-        """Retreive all records from `timed_raw_announcements` table and cache it"""
-        records = await self.pool.fetch_all_timed_raw_announcements()
-        del self.timed_raw_announcements
-        self.timed_raw_announcements = {}
-        for record in records:
-            self.timed_raw_announcements[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "expires": record.expires,
-                "content": record.content,
-            }
-        return self.timed_raw_announcements
-
-    async def list_timed_raw_announcements(self):
-        """Retreive all records from `timed_raw_announcements` table and cache it"""
-        records = await self.pool.fetch_all_timed_raw_announcements()
-        self.all_raw_ta = records
-
-    async def cache_timed_raw_announcement_backups(self):
-        """Retreive all records from `timed_raw_announcements` table and cache it"""
-        records = await self.pool.fetch_all_backup_raw_announcements()
-        del self.raw_backups
-        self.raw_backups = {}
-        for record in records:
-            self.raw_backups[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "expires": record.expires,
-                "content": record.content,
-            }
-        return self.raw_backups
-
-    async def cache_raw_announcements(self):
-        """Retreive all records from `raw_announcements` table and cache it"""
-        records = await self.pool.fetch_all_raw_announcements()
-        del self.raw_announcements
-        self.raw_announcements = {}
-        for record in records:
-            self.raw_announcements[record.announcement_id] = {
-                "channel_id": record.channel_id,
-                "content": record.content,
-            }
-        return self.raw_announcements
-
-    def get_setting(self, guild_id: int) -> Union[DottedDict, None]:
-        """Retreive a `settings` record from internal cache if exists
+    async def _timed_load(self, table: str, loader):
+        """Run a `cache_*` loader and log how many records it cached and how long it took"""
+        started = time.perf_counter()
+        cached = await loader()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.log.info(f"Cached {len(cached)} records from `{table}` in {elapsed:.2f}ms")
+
+    def _bump_watermark(self, table: str, updated_at: datetime):
+        watermark = self.watermarks[table]
+        if watermark is not None and updated_at > watermark:
+            self.watermarks[table] = updated_at
+
+    async def restore_snapshot(self) -> bool:
+        """Load the snapshot file, then only fetch the rows changed since it was written
+
+        Rows stamped after the snapshot's watermarks are fetched and cached, rows which no longer
+        exist are found by comparing the cached keys with every key in the table. Returns whether
+        a usable snapshot was found.
+        """
+        if not self.snapshot_path:
+            return False
+        loop = asyncio.get_event_loop()
+        payload = await loop.run_in_executor(None, read_snapshot, self.snapshot_path)
+        shards = [self.shards[0], list(self.shards[1])] if self.shards is not None else None
+        # a lazy snapshot only holds part of the announcements, eager mode would never fetch the rest
+        if payload is None or payload["shards"] != shards or payload.get("lazy") != self.lazy:
+            return False
+
+        settings = [CachedSetting(*row) for row in payload["settings"]]
+        self.settings = {setting.guild_id: setting for setting in settings}
+        self.prefixes = {setting.guild_id: setting.prefix for setting in settings}
+        self.role_index = self._index_roles(settings)
+        announcements = [CachedAnnouncement(*row) for row in payload["announcements"]]
+        self.announcements = {}
+        self._recent = OrderedDict()
+        for announcement in announcements:
+            self._place_announcement(announcement)
+        self.scheduler.replace(
+            announcement for announcement in announcements if announcement.status == "scheduled"
+        )
+        self.watermarks = dict(payload["watermarks"])
+        changed = await self._apply_changes_since_watermarks()
+        self.log.info(
+            f"Restored {len(settings)} `settings` and {len(announcements)} `announcements` records from "
+            f"{self.snapshot_path}, {changed} changed since"
+        )
+        return True
+
+    async def _apply_changes_since_watermarks(self) -> int:
+        """Cache the rows changed since the watermarks and evict deleted ones, returns how many rows changed
+
+        Rows stamped after the watermarks are fetched and cached, rows which no longer exist are
+        found by comparing the cached keys with every key in the table.
+        """
+        changed_settings, setting_keys, changed_announcements, announcement_keys = await asyncio.gather(
+            self.pool.fetch_settings_changed_since(self.watermarks["settings"] - SNAPSHOT_MARGIN, shards=self.shards),
+            self.pool.fetch_setting_keys(shards=self.shards),
+            self.pool.fetch_announcements_changed_since(self.watermarks["announcements"] - SNAPSHOT_MARGIN, shards=self.shards),
+            self.pool.fetch_announcement_keys(shards=self.shards),
+        )
+        for record in changed_settings:
+            self.upsert_setting(record)
+        for guild_id in self.settings.keys() - set(setting_keys):
+            self.evict_setting(guild_id)
+        for record in changed_announcements:
+            self.upsert_announcement(record)
+        for announcement_id in (self.announcements.keys() | self._recent.keys()) - set(announcement_keys):
+            self.evict_announcement(announcement_id)
+        return len(changed_settings) + len(changed_announcements)
+
+    def _persist_watermarks(self):
+        """Queue storing the watermarks in the backend, they're written once every write queued before them succeeded"""
+        if self.backend.persistent and self._backend_synced:
+            self._persist(self._store_watermarks(dict(self.watermarks)))
+
+    async def _store_watermarks(self, watermarks: dict):
+        if self._write_failed:
+            return
+        for table, watermark in watermarks.items():
+            if watermark is not None:
+                await self.backend.store_watermark(table, self.scope, watermark)
+
+    async def save_snapshot(self):
+        """Write every cached table to the snapshot file, skipped while a watermark is unknown"""
+        if not self.snapshot_path or None in self.watermarks.values():
+            return
+        started = time.perf_counter()
+        header = {
+            "shards": [self.shards[0], list(self.shards[1])] if self.shards is not None else None,
+            "lazy": self.lazy,
+            "watermarks": dict(self.watermarks),
+        }
+        # only the references are copied on the event loop, cached records are replaced instead of
+        # mutated so building the rows, packing and writing can all happen in the executor
+        settings = list(self.settings.values())
+        announcements = [*self.announcements.values(), *self._recent.values()]
+        loop = asyncio.get_event_loop()
+        size = await loop.run_in_executor(
+            None, _write_snapshot_records, self.snapshot_path, header, settings, announcements
+        )
+        elapsed = (time.perf_counter() - started) * 1000
+        self.log.info(f"Wrote {size / 1024:.1f} KiB cache snapshot to {self.snapshot_path} in {elapsed:.2f}ms")
+
+    def start_snapshots(self):
+        """Start writing the snapshot file every `SNAPSHOT_INTERVAL` seconds"""
+        if self.snapshot_path and self._snapshot_task is None:
+            self._snapshot_task = asyncio.ensure_future(self._snapshot_loop())
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            try:
+                await self.save_snapshot()
+            except Exception as error:
+                self.log.error(f"Writing the cache snapshot failed: {error!r}")
+
+    async def warm_up(self, from_backend: bool = True):
+        """Load every table concurrently, each table is fetched exactly once
+
+        A snapshot file is preferred, then a warm cache backend and postgres last.
+
+        Parameters
+        ----------
+        from_backend: bool
+            Whether tables may be read from the snapshot or the cache backend instead of postgres
+        """
+        started = time.perf_counter()
+        if from_backend and await self.restore_snapshot():
+            elapsed = (time.perf_counter() - started) * 1000
+            self.log.info(f"Cache warm-up finished in {elapsed:.2f}ms")
+            return
+        self._backend_loaded.clear()
+        await asyncio.gather(
+            self._timed_load("settings", lambda: self.cache_settings(from_backend)),
+            self._timed_load("announcements", lambda: self.cache_announcements(from_backend)),
+        )
+        if self._backend_loaded:
+            # the backend misses the changes made while no process was listening
+            changed = await self._apply_changes_since_watermarks()
+            self.log.info(f"Fetched {changed} records changed since the cache backend's watermarks")
+        self._backend_synced = True
+        self._persist_watermarks()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.log.info(f"Cache warm-up finished in {elapsed:.2f}ms")
+
+    async def resync(self):
+        """Reload every table from postgres, replacing the internal cache and the backend's copy"""
+        await self.warm_up(from_backend=False)
+
+    async def apply_change(self, change: Union[dict, None]):
+        """Apply a row change published by another process
+
+        Parameters
+        ----------
+        change: Union[dict, None]
+            The `announcer_changes` payload, `None` if changes may have been missed
+        """
+        if change is None:
+            return await self.resync()
+        if not self.owns_guild(change["guild_id"]):
+            return
+        key = change["key"]
+        if change["table"] == "settings":
+            record = None if change["op"] == "DELETE" else await self.pool.fetch_setting(key)
+            if record is None:
+                return self.evict_setting(key)
+            return self.upsert_setting(record)
+        if change["table"] == "announcements":
+            record = None if change["op"] == "DELETE" else await self.pool.fetch_announcement(key)
+            if record is None:
+                return self.evict_announcement(key)
+            return self.upsert_announcement(record)
+
+    def apply_committed(self, unit):
+        """Apply every row written by a committed `UnitOfWork` to internal cache
+
+        Parameters
+        ----------
+        unit: UnitOfWork
+            The committed unit of work
+        """
+        for guild_id in unit.deleted["settings"]:
+            self.evict_setting(guild_id)
+        for announcement_id in unit.deleted["announcements"]:
+            self.evict_announcement(announcement_id)
+        for record in unit.records:
+            if isinstance(record, SettingsRecord):
+                self.upsert_setting(record)
+            else:
+                self.upsert_announcement(record)
+
+    @staticmethod
+    def _index_roles(settings) -> Dict[int, FrozenSet[int]]:
+        """Allowed role IDs of every guild which has some"""
+        return {setting.guild_id: frozenset(setting.allowed_roles) for setting in settings if setting.allowed_roles}
+
+    def upsert_setting(self, record):
+        """Insert or replace a `settings` record in internal cache
+
+        Parameters
+        ----------
+        record: SettingsRecord
+            The record to cache
+        """
+        cached = CachedSetting(record.guild_id, record.allowed_roles, record.prefix)
+        self.settings[record.guild_id] = cached
+        self.prefixes[record.guild_id] = record.prefix
+        if record.allowed_roles:
+            self.role_index[record.guild_id] = frozenset(record.allowed_roles)
+        else:
+            self.role_index.pop(record.guild_id, None)
+        self._bump_watermark("settings", record.updated_at)
+        if self.backend.persistent:
+            self._persist(self.backend.set("settings", record.guild_id, cached.to_row()))
+
+    def evict_setting(self, guild_id: int):
+        """Remove a `settings` record from internal cache if exists
 
         Parameters
         ----------
         guild_id: int
-            The guild ID to lookup
+            The guild ID to remove
         """
-        try:
-            return DottedDict(self.settings[guild_id])
-        except KeyError:
-            return None
+        self.settings.pop(guild_id, None)
+        self.prefixes.pop(guild_id, None)
+        self.role_index.pop(guild_id, None)
+        if self.backend.persistent:
+            self._persist(self.backend.delete("settings", guild_id))
 
-    def get_announcement(self, announcement_id: int) -> Union[DottedDict, None]:
-        """Retreive a `announcements` record from internal cache if exists
+    def upsert_announcement(self, record):
+        """Insert or replace a `announcements` record in internal cache, scheduling it if it's scheduled
 
         Parameters
         ----------
-        announcement_id: int
-            The announcement ID to lookup
+        record: AnnouncementRecord
+            The record to cache
         """
-        try:
-            return DottedDict(self.announcements[announcement_id])
-        except KeyError:
-            return None
+        cached = CachedAnnouncement.from_record(record)
+        self._place_announcement(cached)
+        self._bump_watermark("announcements", record.updated_at)
+        if cached.status == "scheduled":
+            self.scheduler.push(cached)
+        else:
+            self.scheduler.discard(cached.announcement_id)
+        if self.backend.persistent:
+            self._persist(self.backend.set("announcements", cached.announcement_id, cached.to_row()))
+
+    def _place_announcement(self, cached: CachedAnnouncement):
+        """Cache an announcement, unscheduled ones go to the LRU in lazy mode"""
+        key = cached.announcement_id
+        if not self.lazy or cached.status == "scheduled":
+            self._recent.pop(key, None)
+            self.announcements[key] = cached
+            return
+        self.announcements.pop(key, None)
+        self._recent[key] = cached
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_announcements:
+            self._recent.popitem(last=False)
+            self.evictions += 1
 
-    def get_timed_announcement(self, announcement_id: int) -> Union[DottedDict, None]:
-        """Retreive a `announcements` record from internal cache if exists
+    def evict_announcement(self, announcement_id: int):
+        """Remove a `announcements` record from internal cache and the scheduler if exists
 
         Parameters
         ----------
         announcement_id: int
-            The announcement ID to lookup
+            The announcement ID to remove
         """
-        try:
-            return DottedDict(self.backups[announcement_id])
-        except KeyError:
-            return None
+        self.announcements.pop(announcement_id, None)
+        self._recent.pop(announcement_id, None)
+        self.scheduler.discard(announcement_id)
+        if self.backend.persistent:
+            self._persist(self.backend.delete("announcements", announcement_id))
 
-    def get_raw_announcement(self, announcement_id: int) -> Union[DottedDict, None]:
-        """Retreive a `raw_announcements` record from internal cache if exists
+    def get_setting(self, guild_id: int) -> Union[CachedSetting, None]:
+        """Retreive a `settings` record from internal cache if exists
 
         Parameters
         ----------
-        announcement_id: int
-            The announcement ID to lookup
+        guild_id: int
+            The guild ID to lookup
         """
-        try:
-            return DottedDict(self.raw_announcements[announcement_id])
-        except KeyError:
-            return None
+        setting = self.settings.get(guild_id)
+        if setting is None:
+            self.misses["settings"] += 1
+        else:
+            self.hits["settings"] += 1
+        return setting
 
-    def get_timed_raw_announcement(self, announcement_id: int) -> Union[DottedDict, None]:
-        """Retreive a `timed_raw_announcements` record from internal cache if exists
+    def get_prefix(self, guild_id: int) -> str:
+        """Retreive the prefix of a guild from internal cache, falls back to the default prefix
+
+        Parameters
+        ----------
+        guild_id: int
+            The guild ID to lookup
+        """
+        return self.prefixes.get(guild_id, DEFAULT_PREFIX)
+
+    def get_allowed_roles(self, guild_id: int) -> FrozenSet[int]:
+        """Retreive the role IDs allowed to make announcements in a guild, empty if none are
+
+        Parameters
+        ----------
+        guild_id: int
+            The guild ID to lookup
+        """
+        return self.role_index.get(guild_id, NO_ROLES)
+
+    async def get_announcement(self, announcement_id: int, kind: str = None) -> Union[CachedAnnouncement, None]:
+        """Retreive a `announcements` record from internal cache, loading it from postgres on a miss in lazy mode
 
         Parameters
         ----------
         announcement_id: int
             The announcement ID to lookup
+        kind: str
+            Only return the record if it's of this kind, either `embed` or `raw`
         """
-        try:
-            return DottedDict(self.raw_backups[announcement_id])
-        except KeyError:
+        announcement = self.announcements.get(announcement_id)
+        if announcement is None and self.lazy:
+            announcement = self._recent.get(announcement_id)
+            if announcement is not None:
+                self._recent.move_to_end(announcement_id)
+        if announcement is not None:
+            self.hits["announcements"] += 1
+        else:
+            self.misses["announcements"] += 1
+            if self.lazy:
+                record = await self.pool.fetch_announcement(announcement_id)
+                if record is not None and self.owns_guild(record.guild_id):
+                    announcement = CachedAnnouncement.from_record(record)
+                    self._place_announcement(announcement)
+                    if announcement.status == "scheduled":
+                        self.scheduler.push(announcement)
+        if announcement is None or (kind is not None and announcement.kind != kind):
             return None
+        return announcement
+
+    def stats(self) -> dict:
+        """Hit and miss counts per table along with what's resident, used to size the LRU"""
+        return {
+            "mode": "lazy" if self.lazy else "eager",
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "evictions": self.evictions,
+            "settings": len(self.settings),
+            "pinned_announcements": len(self.announcements),
+            "recent_announcements": len(self._recent),
+            "max_announcements": self.max_announcements,
+        }
+
+    async def close(self):
+        """Finish the queued backend writes, store the watermarks and release the backend"""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        self._persist_watermarks()
+        if self._writer is not None:
+            await self._writer
+        await self.backend.close()
 
     def wipe(self):
         """Wipe all the internal cache"""
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
         del self.settings
+        del self.prefixes
+        del self.role_index
         del self.announcements
-        del self.raw_announcements
-        del self.timed_announcements
-        del self.all_raw_ta
-        del self.all_timed_announcements
-        del self.backups
-        del self.raw_backups
+        del self.scheduler
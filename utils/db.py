@@ -1,89 +1,59 @@
 # -*- coding: utf-8 -*-
 
-import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Union, List
+from operator import itemgetter
+from typing import AsyncIterator, Union, List, Tuple
 
 import asyncpg
+import orjson
 from discord import Embed
 
+log = logging.getLogger(__name__)
 
-class SettingsRecord:
-    """Represent a `setting` record"""
 
-    def __init__(self, record: dict) -> None:
-        self.record = record
-        self.id: int = record["id"]
-        self.guild_id: int = record["guild_id"]
-        self.allowed_roles: Union[List[int], None] = (
-            record["allowed_roles"] if record["allowed_roles"] else None
-        )
-        self.prefix: str = record["prefix"]
-
-    def __repr__(self) -> str:
-        return f"<SettingsRecord id={self.id} guild_id={self.guild_id} allowed_roles={self.allowed_roles} prefix={self.prefix}>"
+def _column(name: str) -> property:
+    """Read-only attribute returning a column of the record"""
+    return property(itemgetter(name), doc=f"The `{name}` column")
 
 
-class AnnouncementsRecord:
-    """Represent a `announcements` record"""
+class SettingsRecord(asyncpg.Record):
+    """Represent a `setting` record, asyncpg decodes rows straight into it"""
 
-    def __init__(self, record: dict) -> None:
-        self.record = record
-        self.id: int = record["id"]
-        self.announcement_id: int = record["announcement_id"]
-        self.channel_id: int = record["channel_id"]
-        self.embed_details: dict = json.loads(record["embed_details"])
+    id = _column("id")
+    guild_id = _column("guild_id")
+    prefix = _column("prefix")
+    updated_at = _column("updated_at")
 
-    def build_embed(self):
-        return Embed.from_dict(self.embed_details)
+    @property
+    def allowed_roles(self) -> Union[List[int], None]:
+        return self["allowed_roles"] or None
 
     def __repr__(self) -> str:
-        return f"<AnnouncementsRecord id={self.id} channel_id={self.channel_id} embed_details={self.embed_details}>"
+        return f"<SettingsRecord id={self.id} guild_id={self.guild_id} allowed_roles={self.allowed_roles} prefix={self.prefix}>"
+
 
-class TimedAnnouncementRecord:
-    """Represent a `timed_announcements` record"""
+class AnnouncementRecord(asyncpg.Record):
+    """Represent a `announcements` record, asyncpg decodes rows straight into it"""
 
-    def __init__(self, record: dict) -> None:
-        self.record = record
-        self.id: int = record["id"]
-        self.announcement_id: int = record["announcement_id"]
-        self.expires: datetime = record["expires"]
-        self.channel_id: int = record["channel_id"]
-        self.embed_details: dict = json.loads(record["embed_details"])
+    id = _column("id")
+    announcement_id = _column("announcement_id")
+    guild_id = _column("guild_id")
+    channel_id = _column("channel_id")
+    kind = _column("kind")
+    status = _column("status")
+    embed_details = _column("embed_details")
+    content = _column("content")
+    expires = _column("expires")
+    updated_at = _column("updated_at")
 
     def build_embed(self):
         return Embed.from_dict(self.embed_details)
 
     def __repr__(self) -> str:
-        return f"<AnnouncementsRecord id={self.id} expires={self.expires} channel_id={self.channel_id} embed_details={self.embed_details}>"
-
-
-class TimedRawAnnouncementRecord:
-    """Represent a `timed_raw_announcements` record"""
-
-    def __init__(self, record: dict) -> None:
-        self.record = record
-        self.id: int = record["id"]
-        self.announcement_id: int = record["announcement_id"]
-        self.expires: datetime = record["expires"]
-        self.channel_id: int = record["channel_id"]
-        self.content: str = record["content"]
-
-    def __repr__(self) -> str:
-        return f"<RawAnnouncementRecord id={self.id} expires={self.expires} channel_id={self.channel_id}>"
-
-class RawAnnouncementRecord:
-    """Represent a `raw_announcements` record"""
-
-    def __init__(self, record: dict) -> None:
-        self.record = record
-        self.id: int = record["id"]
-        self.announcement_id: int = record["announcement_id"]
-        self.channel_id: int = record["channel_id"]
-        self.content: str = record["content"]
-
-    def __repr__(self) -> str:
-        return f"<RawAnnouncementRecord id={self.id} channel_id={self.channel_id}>"
+        return f"<AnnouncementRecord id={self.id} announcement_id={self.announcement_id} kind={self.kind} status={self.status} channel_id={self.channel_id} expires={self.expires}>"
 
 
 class NotConnected(Exception):
@@ -95,24 +65,222 @@ class NotConnected(Exception):
         return self.message
 
 
+# channel the `notify_announcer_change` trigger publishes row changes on
+CHANGES_CHANNEL = "announcer_changes"
+# rows fetched per page by the `iter_*` methods
+PAGE_SIZE = 5000
+
+
+def shard_id_for(guild_id: int, shard_count: int) -> int:
+    """The shard a guild belongs to, see discord's sharding formula"""
+    return (guild_id >> 22) % shard_count
+
+
+def _shard_condition(first: int) -> str:
+    """SQL condition matching rows of guilds on the given shards, `first` is the number of the `shard_count` parameter
+
+    Rows without a `guild_id` belong to shard 0.
+    """
+    return f"""((guild_id >> 22) % ${first} = ANY(${first + 1}::integer[]) OR (guild_id IS NULL AND 0 = ANY(${first + 1}::integer[])))"""
+
+
+def _dump_json(obj) -> str:
+    return orjson.dumps(obj).decode("utf-8")
+
+
+# Every statement `Connection` runs, as `name: (query, first shard parameter)`. Queries with a
+# `{shards}` condition get a plain variant and a sharded one taking `shard_count` and `shard_ids`
+# as their last parameters. asyncpg prepares a statement the first time a connection runs it
+# and reuses it afterwards, so every query text here is only parsed and planned once per connection.
+_QUERY_TEMPLATES = {
+    "fetch_setting": ("""SELECT * FROM settings WHERE guild_id = $1;""", None),
+    "page_settings": ("""SELECT * FROM settings WHERE id > $1 AND {shards} ORDER BY id LIMIT $2;""", 3),
+    "fetch_settings_changed_since": ("""SELECT * FROM settings WHERE updated_at >= $1 AND {shards};""", 2),
+    "fetch_setting_keys": ("""SELECT guild_id FROM settings WHERE {shards};""", 1),
+    "insert_setting": ("""INSERT INTO settings(guild_id, allowed_roles) VALUES($1, ARRAY[]::BIGINT[]) RETURNING *;""", None),
+    # guilds whose `settings` row is missing (e.g. joined while the bot was down) get one on their first change
+    "update_prefix": (
+        """INSERT INTO settings(guild_id, allowed_roles, prefix) VALUES($1, ARRAY[]::BIGINT[], $2)
+           ON CONFLICT (guild_id) DO UPDATE SET prefix = EXCLUDED.prefix RETURNING *;""",
+        None,
+    ),
+    "update_allowed_roles": (
+        """INSERT INTO settings(guild_id, allowed_roles) VALUES($1, $2)
+           ON CONFLICT (guild_id) DO UPDATE SET allowed_roles = EXCLUDED.allowed_roles RETURNING *;""",
+        None,
+    ),
+    "delete_setting": ("""DELETE FROM settings WHERE guild_id = $1;""", None),
+    "fetch_announcement": ("""SELECT * FROM announcements WHERE announcement_id = $1;""", None),
+    "page_announcements": ("""SELECT * FROM announcements WHERE id > $1 AND {shards} ORDER BY id LIMIT $2;""", 3),
+    "page_scheduled_announcements": (
+        """SELECT * FROM announcements WHERE id > $1 AND status = 'scheduled' AND {shards} ORDER BY id LIMIT $2;""",
+        3,
+    ),
+    "fetch_announcements_changed_since": ("""SELECT * FROM announcements WHERE updated_at >= $1 AND {shards};""", 2),
+    "fetch_announcement_keys": ("""SELECT announcement_id FROM announcements WHERE {shards};""", 1),
+    "reserve_announcement_ids": (
+        """SELECT nextval('announcement_ids') AS start, increment_by
+           FROM pg_sequences WHERE sequencename = 'announcement_ids';""",
+        None,
+    ),
+    "insert_announcement": (
+        """INSERT INTO announcements(announcement_id, guild_id, channel_id, kind, status, embed_details, content, expires)
+           VALUES($1, $2, $3, $4, $5, $6, $7, $8) RETURNING *;""",
+        None,
+    ),
+    "claim_due_announcements": (
+        """UPDATE announcements SET status = 'in_flight', lease_owner = $1, lease_expires = now() + make_interval(secs => $2)
+           WHERE id IN (
+               SELECT id FROM announcements
+               WHERE ((status = 'scheduled' AND expires <= now())
+                   OR (status = 'in_flight' AND lease_expires <= now()))
+                   AND {shards}
+               ORDER BY expires
+               LIMIT $3
+               FOR UPDATE SKIP LOCKED
+           ) RETURNING *;""",
+        4,
+    ),
+    "mark_sent": (
+        """UPDATE announcements SET status = 'sent' WHERE announcement_id = ANY($1::integer[]) RETURNING *;""",
+        None,
+    ),
+    "mark_sent_by_owner": (
+        """UPDATE announcements SET status = 'sent', lease_owner = NULL, lease_expires = NULL
+           WHERE announcement_id = ANY($1::integer[]) AND lease_owner = $2 RETURNING *;""",
+        None,
+    ),
+    "renew_leases": (
+        """UPDATE announcements SET lease_expires = now() + make_interval(secs => $3)
+           WHERE announcement_id = ANY($1::integer[]) AND lease_owner = $2 AND status = 'in_flight'
+           RETURNING announcement_id;""",
+        None,
+    ),
+    "delete_announcement": ("""DELETE FROM announcements WHERE announcement_id = $1;""", None),
+    "fetch_blacklist": ("""SELECT guild_id FROM blacklist;""", None),
+    "insert_blacklist": (
+        """INSERT INTO blacklist(guild_id, reason) VALUES($1, $2)
+           ON CONFLICT (guild_id) DO UPDATE SET reason = EXCLUDED.reason;""",
+        None,
+    ),
+    "delete_blacklist": ("""DELETE FROM blacklist WHERE guild_id = $1 RETURNING guild_id;""", None),
+}
+
+# `(name, sharded)` to query text
+QUERIES = {}
+for _name, (_template, _first) in _QUERY_TEMPLATES.items():
+    QUERIES[_name, False] = _template.format(shards="TRUE")
+    if _first is not None:
+        QUERIES[_name, True] = _template.format(shards=_shard_condition(_first))
+
+
 class Connection:
     """Represents the connection to postgres"""
 
     async def create_pool(self, uri):
         """Establish connection to the postgres with given uri"""
-        pool = await asyncpg.create_pool(uri)
+        self.uri = uri
+        self._closed = False
+        self._backend_pids = set()
+        pool = await asyncpg.create_pool(uri, init=self._init_connection)
         self.pool = pool
+        self._id_lock = asyncio.Lock()
+        self._next_id = 0
+        self._id_block_end = 0
         return pool
 
+    async def _init_connection(self, connection):
+        """Encode and decode `jsonb` columns as python objects on every new connection"""
+        await connection.set_type_codec(
+            "jsonb", schema="pg_catalog", encoder=_dump_json, decoder=orjson.loads
+        )
+        # changes made through the pool are already applied by whoever made them
+        self._backend_pids.add(connection.get_server_pid())
+
+    async def listen(self, callback):
+        """Listen for row changes made by other processes over a dedicated connection
+
+        Parameters
+        ----------
+        callback: Callable[[Union[dict, None]], Awaitable]
+            Awaited with the payload of every change, or with `None` after the listener
+            reconnected since changes may have been missed meanwhile
+        """
+        self._require_pool()
+        self._change_callback = callback
+        await self._connect_listener()
+
+    async def _connect_listener(self):
+        self._listener = await asyncpg.connect(self.uri)
+        await self._listener.add_listener(CHANGES_CHANNEL, self._on_change)
+        self._listener.add_termination_listener(self._on_listener_terminated)
+
+    def _on_change(self, connection, pid, channel, payload):
+        if pid in self._backend_pids:
+            return
+        asyncio.ensure_future(self._run_change_callback(orjson.loads(payload)))
+
+    async def _run_change_callback(self, change: Union[dict, None]):
+        # runs in its own task, an error would otherwise only surface when the task is collected
+        try:
+            await self._change_callback(change)
+        except Exception:
+            log.exception(f"Failed to apply database change {change}")
+
+    def _on_listener_terminated(self, connection):
+        if not self._closed:
+            asyncio.ensure_future(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        delay = 1
+        while True:
+            try:
+                await self._connect_listener()
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            await self._run_change_callback(None)
+            return
+
     async def close(self):
         """Close the connection to the postgres server only if the connection is made"""
+        self._require_pool()
+        self._closed = True
+        if hasattr(self, "_listener"):
+            await self._listener.close()
+        await self.pool.close()
+
+    def _require_pool(self):
         if not hasattr(self, "pool"):
             raise NotConnected(
                 "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
             )
-        await self.pool.close()
 
-    async def fetch_setting(self, guild_id: int):
+    def _query(self, name: str, args: tuple, shards: Tuple[int, List[int]] = None):
+        """Look up a registered query, appending the shard parameters to `args` for the sharded variant"""
+        self._require_pool()
+        if shards is None:
+            return QUERIES[name, False], args
+        return QUERIES[name, True], (*args, *shards)
+
+    async def _fetch(
+        self, name: str, *args, shards: Tuple[int, List[int]] = None, record_class: type = None
+    ) -> List[asyncpg.Record]:
+        query, args = self._query(name, args, shards)
+        return await self.pool.fetch(query, *args, record_class=record_class)
+
+    async def _fetchrow(
+        self, name: str, *args, shards: Tuple[int, List[int]] = None, record_class: type = None
+    ) -> Union[asyncpg.Record, None]:
+        query, args = self._query(name, args, shards)
+        return await self.pool.fetchrow(query, *args, record_class=record_class)
+
+    async def _execute(self, name: str, *args, shards: Tuple[int, List[int]] = None) -> str:
+        query, args = self._query(name, args, shards)
+        return await self.pool.execute(query, *args)
+
+    async def fetch_setting(self, guild_id: int) -> Union[SettingsRecord, None]:
         """Fetch a record on `setting` column by given `guild_id`
 
         Parameters
@@ -120,252 +288,465 @@ class Connection:
         guild_id: int
             The guild id to lookup
         """
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM settings WHERE guild_id = $1"""
-        record = await self.pool.fetchrow(query, guild_id)
-        return SettingsRecord(record=record)
+        return await self._fetchrow("fetch_setting", guild_id, record_class=SettingsRecord)
 
-    async def fetch_announcement(self, announcement_id: int):
-        """Fetch a record on `announcements` column by given `announcement_id`
+    async def fetch_announcement(self, announcement_id: int) -> Union[AnnouncementRecord, None]:
+        """Fetch a record on `announcements` table by given `announcement_id`
 
         Parameters
         ----------
         announcement_id: int
             The announcement id to lookup
         """
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM announcements WHERE announcement_id = $1"""
-        record = await self.pool.fetchrow(query, announcement_id)
-        if not record:
-            return None
-        return AnnouncementsRecord(record=record)
+        return await self._fetchrow("fetch_announcement", announcement_id, record_class=AnnouncementRecord)
+
+    async def _pages(
+        self, name: str, page_size: int, shards: Tuple[int, List[int]] = None, record_class: type = None
+    ) -> AsyncIterator[List[asyncpg.Record]]:
+        """Run a keyset-paginated query page by page, each page starts after the last `id` of the previous one"""
+        last_id = 0
+        while True:
+            datas = await self._fetch(name, last_id, page_size, shards=shards, record_class=record_class)
+            if not datas:
+                return
+            last_id = datas[-1]["id"]
+            yield datas
+            if len(datas) < page_size:
+                return
+
+    async def iter_settings(
+        self, shards: Tuple[int, List[int]] = None, page_size: int = PAGE_SIZE
+    ) -> AsyncIterator[List[SettingsRecord]]:
+        """Stream all records in `settings` table in pages, only one page is held in memory at a time
+
+        Parameters
+        ----------
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
+        page_size: int
+            Maximum number of records per page
+        """
+        async for records in self._pages("page_settings", page_size, shards, record_class=SettingsRecord):
+            yield records
 
-    async def fetch_timed_announcement(self, announcement_id: int):
-        """Fetch a record on `timed_announcements` column by given `announcement_id`
+    async def iter_announcements(
+        self, shards: Tuple[int, List[int]] = None, page_size: int = PAGE_SIZE, scheduled: bool = False
+    ) -> AsyncIterator[List[AnnouncementRecord]]:
+        """Stream all records in `announcements` table in pages, only one page is held in memory at a time
 
         Parameters
         ----------
-        announcement_id: int
-            The announcement id to lookup
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
+        page_size: int
+            Maximum number of records per page
+        scheduled: bool
+            Only stream scheduled records
         """
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_announcement_backups WHERE announcement_id = $1"""
-        record = await self.pool.fetchrow(query, announcement_id)
-        if not record:
-            return None
-        return AnnouncementsRecord(record=record)
+        name = "page_scheduled_announcements" if scheduled else "page_announcements"
+        async for records in self._pages(name, page_size, shards, record_class=AnnouncementRecord):
+            yield records
 
-    async def fetch_raw_announcement(self, announcement_id: int):
-        """Fetch a record on `raw_announcements` column by given `announcement_id`
+    async def fetch_settings_changed_since(
+        self, since: datetime, shards: Tuple[int, List[int]] = None
+    ) -> List[SettingsRecord]:
+        """Fetch the records in `settings` table changed at or after `since`
 
         Parameters
         ----------
-        announcement_id: int
-            The announcement id to lookup
+        since: datetime
+            Only fetch records whose `updated_at` is at or after this time
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
         """
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM raw_announcements WHERE announcement_id = $1"""
-        record = await self.pool.fetchrow(query, announcement_id)
-        if not record:
-            return None
-        return RawAnnouncementRecord(record=record)
-    
-    async def fetch_timed_raw_announcement(self, announcement_id: int):
-        """Fetch a record on `timed_raw_announcements` column by given `announcement_id`
+        return await self._fetch("fetch_settings_changed_since", since, shards=shards, record_class=SettingsRecord)
+
+    async def fetch_announcements_changed_since(
+        self, since: datetime, shards: Tuple[int, List[int]] = None
+    ) -> List[AnnouncementRecord]:
+        """Fetch the records in `announcements` table changed at or after `since`
 
         Parameters
         ----------
-        announcement_id: int
-            The announcement id to lookup
+        since: datetime
+            Only fetch records whose `updated_at` is at or after this time
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
         """
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_raw_announcements WHERE announcement_id = $1"""
-        record = await self.pool.fetchrow(query, announcement_id)
-        if not record:
-            return None
-        return TimedRawAnnouncementRecord(record=record)
-
-    async def fetch_all_settings(self) -> List[SettingsRecord]:
-        """Fetch all record in `settings` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM settings;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(SettingsRecord(record=data))
-        return records
-
-    async def fetch_all_announcements(self) -> List[AnnouncementsRecord]:
-        """Fetch all record in `announcements` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM announcements;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(AnnouncementsRecord(record=data))
-        return records
-
-    async def fetch_all_timed_announcements(self) -> List[TimedAnnouncementRecord]:
-        """Fetch all record in `timed_announcements` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_announcements;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(TimedAnnouncementRecord(record=data))
-        return records
-
-    async def fetch_all_backup_announcements(self) -> List[TimedAnnouncementRecord]:
-        """Fetch all record in `timed_announcement_backups` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_announcement_backups;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(TimedAnnouncementRecord(record=data))
-        return records
-
-    async def fetch_all_raw_announcements(self) -> List[RawAnnouncementRecord]:
-        """Fetch all record in `raw_announcements` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM raw_announcements;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(RawAnnouncementRecord(record=data))
-        return records
-
-    async def fetch_all_timed_raw_announcements(self) -> List[TimedRawAnnouncementRecord]:
-        """Fetch all record in `timed_raw_announcements` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_raw_announcements;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(TimedRawAnnouncementRecord(record=data))
-        return records
-
-    async def fetch_all_backup_raw_announcements(self) -> List[TimedRawAnnouncementRecord]:
-        """Fetch all record in `timed_announcement_backups` table"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        query = """SELECT * FROM timed_raw_announcement_backups;"""
-        records = []
-        datas = await self.pool.fetch(query=query)
-        for data in datas:
-            records.append(TimedRawAnnouncementRecord(record=data))
-        return records
-
-    async def execute(self, query, *args):
-        """Execute SQL Query"""
-        if not hasattr(self, "pool"):
-            raise NotConnected(
-                "connection to postgres server haven't established yet, call `Pool.create_pool` method first"
-            )
-        await self.pool.execute(query, *args)
+        return await self._fetch("fetch_announcements_changed_since", since, shards=shards, record_class=AnnouncementRecord)
 
+    async def fetch_setting_keys(self, shards: Tuple[int, List[int]] = None) -> List[int]:
+        """Fetch the `guild_id` of every record in `settings` table
 
-class Blacklist:
-    """Handle blacklisting guild"""
+        Parameters
+        ----------
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
+        """
+        return [data["guild_id"] for data in await self._fetch("fetch_setting_keys", shards=shards)]
 
-    def add(self, guild_id: int):
-        """Add the given guild id to the blacklist
+    async def fetch_announcement_keys(self, shards: Tuple[int, List[int]] = None) -> List[int]:
+        """Fetch the `announcement_id` of every record in `announcements` table
+
+        Parameters
+        ----------
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only fetch records of guilds on these shards
+        """
+        return [data["announcement_id"] for data in await self._fetch("fetch_announcement_keys", shards=shards)]
+
+    async def insert_setting(self, guild_id: int) -> SettingsRecord:
+        """Insert a record with the default settings into `settings` table
 
         Parameters
         ----------
         guild_id: int
-            the guild id which is going to blacklisted
+            The guild the settings belong to
         """
-        with open("data/blacklist.json", "r") as f:
-            data = json.load(f)
+        return await self._fetchrow("insert_setting", guild_id, record_class=SettingsRecord)
+
+    async def update_prefix(self, guild_id: int, prefix: str) -> SettingsRecord:
+        """Change the prefix of a guild, its `settings` record is created if it's missing
 
-        data["list"].append(guild_id)
+        Parameters
+        ----------
+        guild_id: int
+            The guild id to update
+        prefix: str
+            The new prefix
+        """
+        return await self._fetchrow("update_prefix", guild_id, prefix, record_class=SettingsRecord)
 
-        with open("data/blacklist.json", "w") as f:
-            json.dump(data, f, indent=4)
+    async def update_allowed_roles(self, guild_id: int, allowed_roles: List[int]) -> SettingsRecord:
+        """Replace the roles allowed to make announcements in a guild, its `settings` record is created if it's missing
 
-        # updating cache
-        self.cache()
+        Parameters
+        ----------
+        guild_id: int
+            The guild id to update
+        allowed_roles: List[int]
+            The new role ids
+        """
+        return await self._fetchrow("update_allowed_roles", guild_id, allowed_roles, record_class=SettingsRecord)
 
-    def remove(self, guild_id: int):
-        """Remove the given guild id to the blacklist
+    async def delete_setting(self, guild_id: int):
+        """Delete a record on `settings` table by given `guild_id`
 
         Parameters
         ----------
         guild_id: int
-            the guild id which is going to removed from blacklisted lists
+            The guild id to delete
         """
-        with open("data/blacklist.json", "r") as f:
-            data = json.load(f)
+        await self._execute("delete_setting", guild_id)
 
-        data["list"].remove(guild_id)
+    async def fetch_blacklist(self) -> List[int]:
+        """Fetch every blacklisted guild id"""
+        return [record["guild_id"] for record in await self._fetch("fetch_blacklist")]
 
-        with open("data/blacklist.json", "w") as f:
-            json.dump(data, f, indent=4)
+    async def insert_blacklist(self, guild_id: int, reason: str = None):
+        """Blacklist a guild, replacing the reason if it's already blacklisted
 
-        # updating cache
-        self.cache()
+        Parameters
+        ----------
+        guild_id: int
+            The guild id to blacklist
+        reason: str
+            Why the guild is blacklisted
+        """
+        await self._execute("insert_blacklist", guild_id, reason)
 
-    def is_blacklisted(self, guild_id: int, cache=True):
-        """Check if the given guild_id is blacklisted
+    async def delete_blacklist(self, guild_id: int) -> bool:
+        """Remove a guild from the blacklist, returns whether it was blacklisted
 
         Parameters
         ----------
         guild_id: int
-            The guild ID to check whether it's blacklisted or not
+            The guild id to remove
+        """
+        return await self._fetchrow("delete_blacklist", guild_id) is not None
+
+    async def allocate_announcement_id(self) -> int:
+        """Allocate an unused announcement ID
+
+        IDs are handed out from a block reserved with a single `nextval` call on the
+        `announcement_ids` sequence, so only one in every `INCREMENT BY` calls hits postgres.
+        """
+        self._require_pool()
+        async with self._id_lock:
+            if self._next_id >= self._id_block_end:
+                record = await self._fetchrow("reserve_announcement_ids")
+                self._next_id = record["start"]
+                self._id_block_end = record["start"] + record["increment_by"]
+            announcement_id = self._next_id
+            self._next_id += 1
+            return announcement_id
+
+    async def insert_announcement(
+        self,
+        announcement_id: int,
+        guild_id: int,
+        channel_id: int,
+        kind: str,
+        embed_details: dict = None,
+        content: str = None,
+        expires: datetime = None,
+    ) -> AnnouncementRecord:
+        """Insert a record into `announcements` table, it's scheduled if `expires` is given
+
+        Parameters
+        ----------
+        announcement_id: int
+            The announcement id
+        guild_id: int
+            The guild the announcement was made in
+        channel_id: int
+            The channel to post the announcement in
+        kind: str
+            Either `embed` or `raw`
+        embed_details: dict
+            The embed of an `embed` announcement
+        content: str
+            The content of a `raw` announcement
+        expires: datetime
+            When a scheduled announcement should be posted
+        """
+        status = "scheduled" if expires else "sent"
+        return await self._fetchrow(
+            "insert_announcement",
+            announcement_id, guild_id, channel_id, kind, status, embed_details, content, expires,
+            record_class=AnnouncementRecord,
+        )
+
+    async def claim_due_announcements(
+        self, owner: str, lease: float, limit: int, shards: Tuple[int, List[int]] = None
+    ) -> List[AnnouncementRecord]:
+        """Lease due announcements to a worker, announcements whose lease expired are reclaimed
 
-        cache: bool
-            Whether to lookup in internal cache
+        Rows locked by other workers are skipped, so concurrent workers never claim the same row.
+
+        Parameters
+        ----------
+        owner: str
+            The worker claiming the announcements
+        lease: float
+            Seconds until the claimed announcements can be reclaimed by another worker
+        limit: int
+            Maximum number of announcements to claim
+        shards: Tuple[int, List[int]]
+            `(shard_count, shard_ids)`, only claim announcements of guilds on these shards
+        """
+        return await self._fetch("claim_due_announcements", owner, lease, limit, shards=shards, record_class=AnnouncementRecord)
+
+    async def mark_sent(self, announcement_ids: List[int], owner: str = None) -> List[AnnouncementRecord]:
+        """Mark the given scheduled announcements as sent
+
+        Parameters
+        ----------
+        announcement_ids: List[int]
+            The announcement ids to update
+        owner: str
+            Only update announcements still leased to this worker
         """
-        if cache:
-            if not hasattr(self, "_cache"):
-                self.cache()
-                return guild_id in self._cache
-            return guild_id in self._cache
+        if owner is None:
+            return await self._fetch("mark_sent", announcement_ids, record_class=AnnouncementRecord)
+        return await self._fetch("mark_sent_by_owner", announcement_ids, owner, record_class=AnnouncementRecord)
+
+    async def renew_leases(self, announcement_ids: List[int], owner: str, lease: float) -> List[int]:
+        """Extend the leases a worker still holds, returns the ids whose lease was renewed
 
-        with open("data/blacklist.json", "r") as f:
-            data = json.load(f)
+        Parameters
+        ----------
+        announcement_ids: List[int]
+            The announcement ids to renew
+        owner: str
+            The worker holding the leases
+        lease: float
+            Seconds from now until the announcements can be reclaimed by another worker
+        """
+        records = await self._fetch("renew_leases", announcement_ids, owner, lease)
+        return [record["announcement_id"] for record in records]
 
-        return guild_id in data["list"]
+    async def delete_announcement(self, announcement_id: int):
+        """Delete a record on `announcements` table by given `announcement_id`
 
-    def cache(self):
+        Parameters
+        ----------
+        announcement_id: int
+            The announcement id to delete
+        """
+        await self._execute("delete_announcement", announcement_id)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Group writes into one transaction on one connection
+
+        Writes queued on the yielded `UnitOfWork` are sent when the block exits without an
+        error, a single write is sent without `BEGIN`/`COMMIT` since it's atomic on its own.
+
+        Examples
+        --------
+        async with bot.pool.unit_of_work() as unit:
+            unit.insert_announcement(...)
+        bot.cache.apply_committed(unit)
+        """
+        self._require_pool()
+        unit = UnitOfWork(self)
+        yield unit
+        await unit.commit()
+
+
+class UnitOfWork:
+    """Writes queued to be committed together, see `Connection.unit_of_work`
+
+    Attributes
+    ----------
+    records: List[Union[SettingsRecord, AnnouncementRecord]]
+        Rows returned by the committed writes, in the order the writes were queued
+    deleted: Dict[str, List[int]]
+        Keys of the deleted rows per table
+    """
+
+    def __init__(self, connection: Connection):
+        self._connection = connection
+        self._writes = []
+        self.records = []
+        self.deleted = {"settings": [], "announcements": []}
+        self.committed = False
+
+    def _queue(self, name: str, *args, record_class: type = None):
+        if self.committed:
+            raise RuntimeError("This unit of work was already committed")
+        self._writes.append((name, args, record_class))
+
+    async def commit(self):
+        """Send every queued write, in one transaction if there are several"""
+        queries = [(self._connection._query(name, args)[0], args, record_class) for name, args, record_class in self._writes]
+        if queries:
+            async with self._connection.pool.acquire() as connection:
+                if len(queries) == 1:
+                    query, args, record_class = queries[0]
+                    self.records.extend(await connection.fetch(query, *args, record_class=record_class))
+                else:
+                    async with connection.transaction():
+                        for query, args, record_class in queries:
+                            self.records.extend(await connection.fetch(query, *args, record_class=record_class))
+        self.committed = True
+
+    def insert_setting(self, guild_id: int):
+        """Queue inserting a record with the default settings, see `Connection.insert_setting`"""
+        self._queue("insert_setting", guild_id, record_class=SettingsRecord)
+
+    def update_prefix(self, guild_id: int, prefix: str):
+        """Queue changing the prefix of a guild, see `Connection.update_prefix`"""
+        self._queue("update_prefix", guild_id, prefix, record_class=SettingsRecord)
+
+    def update_allowed_roles(self, guild_id: int, allowed_roles: List[int]):
+        """Queue replacing the allowed roles of a guild, see `Connection.update_allowed_roles`"""
+        self._queue("update_allowed_roles", guild_id, allowed_roles, record_class=SettingsRecord)
+
+    def delete_setting(self, guild_id: int):
+        """Queue deleting the settings of a guild, see `Connection.delete_setting`"""
+        self._queue("delete_setting", guild_id)
+        self.deleted["settings"].append(guild_id)
+
+    def insert_announcement(
+        self,
+        announcement_id: int,
+        guild_id: int,
+        channel_id: int,
+        kind: str,
+        embed_details: dict = None,
+        content: str = None,
+        expires: datetime = None,
+    ):
+        """Queue inserting an announcement, see `Connection.insert_announcement`"""
+        status = "scheduled" if expires else "sent"
+        self._queue(
+            "insert_announcement",
+            announcement_id, guild_id, channel_id, kind, status, embed_details, content, expires,
+            record_class=AnnouncementRecord,
+        )
+
+    def delete_announcement(self, announcement_id: int):
+        """Queue deleting an announcement, see `Connection.delete_announcement`"""
+        self._queue("delete_announcement", announcement_id)
+        self.deleted["announcements"].append(announcement_id)
+
+
+class Blacklist:
+    """Handle blacklisting guild
+
+    The blacklist lives in the `blacklist` table and is cached as a frozenset, which is
+    replaced rather than mutated so lookups never see a half-applied change.
+
+    Parameters
+    ----------
+    pool: Connection
+        The connection to postgres, it only has to be connected once `load` is called
+    """
+
+    def __init__(self, pool: Connection):
+        self.pool = pool
+        self._cache = frozenset()
+
+    def __iter__(self):
+        return iter(sorted(self._cache))
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def load(self):
         """Cache the blacklist data"""
-        with open("data/blacklist.json", "r") as f:
-            data = json.load(f)
+        self._cache = frozenset(await self.pool.fetch_blacklist())
+
+    async def add(self, guild_id: int, reason: str = None):
+        """Add the given guild id to the blacklist
 
-        self._cache = data["list"]
+        Parameters
+        ----------
+        guild_id: int
+            the guild id which is going to blacklisted
+        reason: str
+            Why the guild is blacklisted
+        """
+        await self.pool.insert_blacklist(guild_id, reason)
+        self._cache = self._cache | {guild_id}
+
+    async def remove(self, guild_id: int) -> bool:
+        """Remove the given guild id to the blacklist, returns whether it was blacklisted
+
+        Parameters
+        ----------
+        guild_id: int
+            the guild id which is going to removed from blacklisted lists
+        """
+        removed = await self.pool.delete_blacklist(guild_id)
+        self._cache = self._cache - {guild_id}
+        return removed
+
+    def is_blacklisted(self, guild_id: int) -> bool:
+        """Check if the given guild_id is blacklisted
+
+        Parameters
+        ----------
+        guild_id: int
+            The guild ID to check whether it's blacklisted or not
+        """
+        return guild_id in self._cache
+
+    async def apply_change(self, change: Union[dict, None]) -> bool:
+        """Apply a `blacklist` change published by another process, returns whether the guild got blacklisted
+
+        Parameters
+        ----------
+        change: Union[dict, None]
+            The `announcer_changes` payload, `None` if changes may have been missed
+        """
+        if change is None:
+            await self.load()
+            return False
+        if change["op"] == "DELETE":
+            self._cache = self._cache - {change["key"]}
+            return False
+        self._cache = self._cache | {change["key"]}
+        return True
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Dict, List, Tuple
+
+# lower values are sent first
+PRIORITY_SCHEDULED = 0
+PRIORITY_COMMAND = 1
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` acquisitions every `per` seconds
+
+    Parameters
+    ----------
+    rate: int
+        Number of tokens the bucket holds when full
+    per: float
+        Seconds it takes to refill an empty bucket
+    """
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.rate
+
+    def take(self, reserve: int = 0) -> float:
+        """Take a token if more than `reserve` tokens are left, returns how long to wait otherwise"""
+        self._refill()
+        if self.tokens >= 1 + reserve:
+            self.tokens -= 1
+            return 0.0
+        return (1 + reserve - self.tokens) * self.per / self.rate
+
+    async def acquire(self, reserve: int = 0) -> None:
+        """Wait until a token could be taken
+
+        Parameters
+        ----------
+        reserve: int
+            Number of tokens which have to be left in the bucket for other callers
+        """
+        while True:
+            delay = self.take(reserve)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class DeliveryQueue:
+    """Queues outgoing messages per channel and drains them within discord's rate limits
+
+    Every channel has its own priority queue drained by a single worker, which waits on
+    the channel's bucket and on the global bucket before each send. Command-initiated
+    sends leave part of the global bucket to scheduled deliveries.
+
+    Parameters
+    ----------
+    channel_rate: int
+        Messages allowed per channel every `channel_per` seconds
+    channel_per: float
+        Window of the per-channel limit
+    global_rate: int
+        Messages allowed across all channels every `global_per` seconds
+    global_per: float
+        Window of the global limit
+    scheduled_reserve: int
+        Global tokens command-initiated sends can't use
+    """
+
+    def __init__(
+        self,
+        channel_rate: int = 5,
+        channel_per: float = 5.0,
+        global_rate: int = 50,
+        global_per: float = 1.0,
+        scheduled_reserve: int = 10,
+    ):
+        self.channel_rate = channel_rate
+        self.channel_per = channel_per
+        self.scheduled_reserve = scheduled_reserve
+        self._global = TokenBucket(global_rate, global_per)
+        self._counter = itertools.count()
+        self._queues: Dict[int, list] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    @property
+    def depth(self) -> int:
+        """Number of messages waiting to be sent across all channels"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def channel_depth(self, channel_id: int) -> int:
+        """Number of messages waiting to be sent in the given channel"""
+        return len(self._queues.get(channel_id, ()))
+
+    def busiest(self, limit: int = 5) -> List[Tuple[int, int]]:
+        """The channels with the most queued messages as `(channel_id, depth)` pairs"""
+        depths = [(channel_id, len(queue)) for channel_id, queue in self._queues.items() if queue]
+        return heapq.nlargest(limit, depths, key=lambda item: item[1])
+
+    def send(self, channel, *, priority: int = PRIORITY_COMMAND, **kwargs) -> asyncio.Future:
+        """Queue a message for the given channel, returns a future resolving to the sent message
+
+        Parameters
+        ----------
+        channel: discord.abc.Messageable
+            The channel to send the message in
+        priority: int
+            `PRIORITY_SCHEDULED` or `PRIORITY_COMMAND`, lower values are sent first
+        kwargs:
+            Passed to `channel.send`
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        queue = self._queues.setdefault(channel.id, [])
+        heapq.heappush(queue, (priority, next(self._counter), kwargs, future))
+        if channel.id not in self._workers:
+            self._workers[channel.id] = loop.create_task(self._drain(channel))
+        return future
+
+    async def _drain(self, channel) -> None:
+        queue = self._queues[channel.id]
+        bucket = self._buckets.get(channel.id)
+        if bucket is None:
+            bucket = self._buckets[channel.id] = TokenBucket(self.channel_rate, self.channel_per)
+        try:
+            while queue:
+                await bucket.acquire()
+                # the head may have changed while waiting, so the priority is read again
+                reserve = 0 if queue[0][0] == PRIORITY_SCHEDULED else self.scheduled_reserve
+                await self._global.acquire(reserve)
+                _, _, kwargs, future = heapq.heappop(queue)
+                if future.done():
+                    continue
+                # the future can be cancelled while sending, every outcome is only set if it's still wanted
+                try:
+                    message = await channel.send(**kwargs)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            del self._workers[channel.id]
+            if not queue:
+                del self._queues[channel.id]
+            self._prune_buckets()
+
+    def _prune_buckets(self) -> None:
+        """Forget the buckets of idle channels once they have refilled"""
+        for channel_id in [channel_id for channel_id, bucket in self._buckets.items() if bucket.full]:
+            if channel_id not in self._workers:
+                del self._buckets[channel_id]
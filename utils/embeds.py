@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import re
+from typing import List, Tuple, Union
+
+import orjson
+
+# discord's embed limits, an embed breaking any of them is rejected by the API
+TITLE_LIMIT = 256
+DESCRIPTION_LIMIT = 4096
+FIELDS_LIMIT = 25
+FIELD_NAME_LIMIT = 256
+FIELD_VALUE_LIMIT = 1024
+FOOTER_LIMIT = 2048
+AUTHOR_LIMIT = 256
+TOTAL_LIMIT = 6000
+
+# same image URLs the interactive commands accept
+IMAGE_URL = re.compile(r"(?i)^https?://\S+\.(?:png|jpg|jpeg|gif|gifv|webm)(?:\?\S*)?$")
+URL = re.compile(r"(?i)^https?://\S+$")
+HEX_COLOR = re.compile(r"^(?:#|0x)?((?:[0-9a-fA-F]{3}){1,2})$")
+CODE_BLOCK = re.compile(r"^```(\w*)\n(.*)\n?```$", re.DOTALL)
+
+# keys of the `key: value` format, a line not starting with one continues the previous value
+KEYS = (
+    "title", "description", "url", "color", "colour", "thumbnail", "image",
+    "footer", "footer_icon", "author", "author_url", "author_icon", "field", "time",
+)
+KEY_LINE = re.compile(rf"^({'|'.join(KEYS)})\s*:\s?(.*)$", re.IGNORECASE)
+
+
+class EmbedError(Exception):
+    """The announcement couldn't be parsed or breaks embed limits, `problems` lists every reason"""
+
+    def __init__(self, problems: List[str]):
+        self.problems = problems
+        super().__init__("\n".join(problems))
+
+
+def _load_yaml(text: str):
+    try:
+        import yaml
+    except ImportError:
+        raise EmbedError(["YAML announcements require the `pyyaml` package"]) from None
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise EmbedError([f"Invalid YAML: {e}"]) from None
+
+
+def _load_key_values(text: str) -> dict:
+    data = {}
+    fields = []
+    key = None
+    for line in text.splitlines():
+        match = KEY_LINE.match(line)
+        if match is None:
+            if key is None:
+                if line.strip():
+                    raise EmbedError([f"Expected `key: value`, got `{line[:50]}`"])
+                continue
+            # continuation of a multi-line value
+            if key == "field":
+                fields[-1] += "\n" + line
+            else:
+                data[key] += "\n" + line
+            continue
+        key, value = match.group(1).lower(), match.group(2)
+        if key == "field":
+            fields.append(value)
+        else:
+            data[key] = value
+    if fields:
+        data["fields"] = []
+        for field in fields:
+            name, _, rest = field.partition("|")
+            # a trailing `| inline` flag puts the field next to the previous one
+            value, _, flag = rest.rpartition("|")
+            inline = "|" in rest and flag.strip().lower() == "inline"
+            data["fields"].append({"name": name.strip(), "value": (value if inline else rest).strip(), "inline": inline})
+    return {key: value.strip() if isinstance(value, str) else value for key, value in data.items()}
+
+
+def load_source(text: str, filename: str = None) -> dict:
+    """Load an announcement written as JSON, YAML or `key: value` lines
+
+    The format is picked from the attachment's extension or the language of a code block,
+    otherwise text starting with `{` is JSON and anything else `key: value` lines.
+
+    Parameters
+    ----------
+    text: str
+        The message content or attachment
+    filename: str
+        The attachment's filename if the text was attached
+    """
+    text = text.strip()
+    fmt = None
+    block = CODE_BLOCK.match(text)
+    if block is not None:
+        fmt, text = block.group(1).lower() or None, block.group(2).strip()
+    if filename is not None:
+        fmt = filename.rpartition(".")[2].lower()
+    if fmt is None:
+        fmt = "json" if text.startswith("{") else "kv"
+
+    if fmt == "json":
+        try:
+            data = orjson.loads(text)
+        except orjson.JSONDecodeError as e:
+            raise EmbedError([f"Invalid JSON: {e}"]) from None
+    elif fmt in ("yaml", "yml"):
+        data = _load_yaml(text)
+    else:
+        data = _load_key_values(text)
+    if not isinstance(data, dict):
+        raise EmbedError(["The announcement must be a mapping of embed keys"])
+    return data
+
+
+def _text(value, name: str, limit: int, problems: List[str]) -> Union[str, None]:
+    if value is None:
+        return None
+    value = str(value)
+    if len(value) > limit:
+        problems.append(f"`{name}` is {len(value)} characters long, the limit is {limit}")
+    return value
+
+
+def _url(value, name: str, pattern, problems: List[str]) -> Union[str, None]:
+    if value is None:
+        return None
+    if not isinstance(value, str) or pattern.match(value) is None:
+        problems.append(f"`{name}` must be a valid {'image ' if pattern is IMAGE_URL else ''}URL")
+    return value
+
+
+def build_embed(data: dict) -> Tuple[dict, Union[str, None]]:
+    """Validate an announcement against discord's embed limits in one pass
+
+    Returns the embed as a dict for `discord.Embed.from_dict` along with the `time` to schedule it
+    in, `None` if it's posted right away. Every problem found is raised at once in an `EmbedError`.
+
+    Parameters
+    ----------
+    data: dict
+        The announcement loaded by `load_source`
+    """
+    problems = []
+    data = {str(key).lower(): value for key, value in data.items()}
+    unknown = data.keys() - set(KEYS) - {"fields"}
+    if unknown:
+        problems.append(f"Unknown keys: {', '.join(f'`{key}`' for key in sorted(unknown))}")
+
+    embed = {"type": "rich"}
+    total = 0
+    title = _text(data.get("title"), "title", TITLE_LIMIT, problems)
+    if title:
+        embed["title"] = title
+        total += len(title)
+    description = _text(data.get("description"), "description", DESCRIPTION_LIMIT, problems)
+    if description:
+        embed["description"] = description
+        total += len(description)
+    url = _url(data.get("url"), "url", URL, problems)
+    if url:
+        embed["url"] = url
+
+    color = data.get("color", data.get("colour"))
+    if isinstance(color, int) and not isinstance(color, bool) and 0 <= color <= 0xFFFFFF:
+        embed["color"] = color
+    elif isinstance(color, str) and HEX_COLOR.match(color.strip()):
+        digits = HEX_COLOR.match(color.strip()).group(1)
+        embed["color"] = int(digits if len(digits) == 6 else "".join(digit * 2 for digit in digits), 16)
+    elif color is not None:
+        problems.append("`color` must be a hex color like `#fec80b`")
+
+    thumbnail = _url(data.get("thumbnail"), "thumbnail", IMAGE_URL, problems)
+    if thumbnail:
+        embed["thumbnail"] = {"url": thumbnail}
+    image = _url(data.get("image"), "image", IMAGE_URL, problems)
+    if image:
+        embed["image"] = {"url": image}
+
+    footer = data.get("footer")
+    if isinstance(footer, dict):
+        footer, footer_icon = footer.get("text"), footer.get("icon_url")
+    else:
+        footer_icon = data.get("footer_icon")
+    footer = _text(footer, "footer", FOOTER_LIMIT, problems)
+    if footer:
+        embed["footer"] = {"text": footer}
+        total += len(footer)
+        footer_icon = _url(footer_icon, "footer_icon", IMAGE_URL, problems)
+        if footer_icon:
+            embed["footer"]["icon_url"] = footer_icon
+
+    author = data.get("author")
+    if isinstance(author, dict):
+        author, author_url, author_icon = author.get("name"), author.get("url"), author.get("icon_url")
+    else:
+        author_url, author_icon = data.get("author_url"), data.get("author_icon")
+    author = _text(author, "author", AUTHOR_LIMIT, problems)
+    if author:
+        embed["author"] = {"name": author}
+        total += len(author)
+        author_url = _url(author_url, "author_url", URL, problems)
+        if author_url:
+            embed["author"]["url"] = author_url
+        author_icon = _url(author_icon, "author_icon", IMAGE_URL, problems)
+        if author_icon:
+            embed["author"]["icon_url"] = author_icon
+
+    fields = data.get("fields", data.get("field")) or []
+    if isinstance(fields, dict):
+        fields = [fields]
+    if not isinstance(fields, list):
+        problems.append("`fields` must be a list of `name`, `value` and `inline` mappings")
+        fields = []
+    if len(fields) > FIELDS_LIMIT:
+        problems.append(f"There are {len(fields)} fields, the limit is {FIELDS_LIMIT}")
+    embed_fields = []
+    for index, field in enumerate(fields, start=1):
+        if not isinstance(field, dict) or not field.get("name") or not field.get("value"):
+            problems.append(f"Field #{index} needs both a `name` and a `value`")
+            continue
+        name = _text(field["name"], f"field #{index} name", FIELD_NAME_LIMIT, problems)
+        value = _text(field["value"], f"field #{index} value", FIELD_VALUE_LIMIT, problems)
+        embed_fields.append({"name": name, "value": value, "inline": bool(field.get("inline", False))})
+        total += len(name) + len(value)
+    if embed_fields:
+        embed["fields"] = embed_fields
+
+    if not embed.keys() - {"type", "url", "color"} and not problems:
+        problems.append("The embed is empty, give it at least a `title` or `description`")
+    if total > TOTAL_LIMIT:
+        problems.append(f"The embed has {total} characters in total, the limit is {TOTAL_LIMIT}")
+    if problems:
+        raise EmbedError(problems)
+
+    time = data.get("time")
+    return embed, str(time).strip() if time is not None else None
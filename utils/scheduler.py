@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import heapq
+import itertools
+from datetime import datetime, timezone
+from typing import Iterable, List, Any
+
+
+def _timestamp(expires: datetime) -> float:
+    """Convert an `expires` value into a POSIX timestamp, naive values are treated as UTC"""
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    return expires.timestamp()
+
+
+class Scheduler:
+    """Min-heap of timed announcements keyed on their `expires` time
+
+    Consumers await `get_due` which sleeps until the earliest entry is due, pushing an
+    entry that becomes the new head wakes the sleeper early. Removed entries are
+    dropped lazily when they reach the head of the heap, or all at once when they
+    make up more than half of it.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, record) -> None:
+        """Schedule a record, replacing any existing entry with the same announcement ID
+
+        Parameters
+        ----------
+        record: Any
+            The record to schedule, must have `announcement_id` and `expires` attributes
+        """
+        self.discard(record.announcement_id)
+        key = record.announcement_id
+        entry = [_timestamp(record.expires), next(self._counter), key, record]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def discard(self, announcement_id: int) -> None:
+        """Remove a scheduled record if exists
+
+        Parameters
+        ----------
+        announcement_id: int
+            The announcement ID to remove
+        """
+        entry = self._entries.pop(announcement_id, None)
+        if entry is not None:
+            entry[-1] = None
+            # `push` goes through here as well, so re-scheduling can't pile up removed entries either
+            self._compact()
+
+    def replace(self, records: Iterable) -> None:
+        """Replace every scheduled record
+
+        Parameters
+        ----------
+        records: Iterable
+            The records to schedule
+        """
+        for entry in self._entries.values():
+            entry[-1] = None
+        self._entries = {}
+        for record in records:
+            self.push(record)
+        self._compact()
+
+    def _compact(self) -> None:
+        """Drop removed entries once they make up more than half of the heap"""
+        if len(self._heap) > 2 * len(self._entries):
+            self._heap = [entry for entry in self._heap if entry[-1] is not None]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> List[Any]:
+        """Remove and return every record due at `now` in `expires` order"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key, record = heapq.heappop(self._heap)
+            if record is None:
+                continue
+            del self._entries[key]
+            due.append(record)
+        return due
+
+    async def get_due(self) -> List[Any]:
+        """Wait until at least one scheduled record is due, then remove and return all due records"""
+        while True:
+            while self._heap and self._heap[0][-1] is None:
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            now = datetime.now(timezone.utc).timestamp()
+            delay = self._heap[0][0] - now
+            if delay <= 0:
+                return self._pop_due(now)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
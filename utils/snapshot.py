@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import mmap
+import os
+from typing import Union
+
+import msgpack
+
+# bumped whenever the layout of the snapshot changes, older snapshots are ignored
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(path: str, payload: dict) -> int:
+    """Atomically write a snapshot, returns its size in bytes
+
+    The payload is written to a temporary file which replaces the old snapshot, so a
+    crash while writing never leaves a truncated snapshot behind.
+
+    Parameters
+    ----------
+    path: str
+        Where the snapshot is written
+    payload: dict
+        The snapshot, datetimes must be timezone aware
+    """
+    data = msgpack.packb({"version": SNAPSHOT_VERSION, **payload}, use_bin_type=True, datetime=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return len(data)
+
+
+def read_snapshot(path: str) -> Union[dict, None]:
+    """Read a snapshot written by `write_snapshot`, returns `None` if it's missing, empty or outdated
+
+    Parameters
+    ----------
+    path: str
+        Where the snapshot was written
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        # unpacking straight from the mapping avoids copying the file into memory first
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            payload = msgpack.unpackb(mapped, raw=False, timestamp=3, strict_map_key=False)
+    if payload.get("version") != SNAPSHOT_VERSION:
+        return None
+    return payload
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import json
-import random
+import sys
 
+import discord
 from discord import Embed
 
 
@@ -26,20 +27,63 @@ def generate_embed(description, color=0xFEC80B, **kwargs):
     return embed
 
 
-async def check_allowed(ctx):
-    """Check if the top_role of author is allowed to use announcement commands"""
-    settings = ctx.bot.cache.get_setting(ctx.guild.id)
-    if not settings.allowed_roles:
+async def check_allowed(ctx, member=None):
+    """Check if any role of the author, or of the given member, is allowed to use announcement commands
+
+    Returns `None` if the guild has no allowed roles. The member's role IDs are checked against
+    the cached index of allowed roles, so it runs in O(roles) without building any list or set.
+
+    The role IDs are read from `Member._roles`, a private attribute of discord.py 1.7 (pinned in
+    requirements.txt) which `Member.roles` would otherwise resolve and sort into `Role` objects.
+    The public property is used if the attribute ever goes away.
+    """
+    allowed_roles = ctx.bot.cache.get_allowed_roles(ctx.guild.id)
+    if not allowed_roles:
+        return None
+    member = member or ctx.author
+    role_ids = getattr(member, "_roles", None)
+    if role_ids is None:
+        role_ids = (role.id for role in member.roles)
+    return not allowed_roles.isdisjoint(role_ids)
+
+
+async def resolve_member(ctx):
+    """Return the author as a guild member, fetching it when the message payload didn't carry one"""
+    if isinstance(ctx.author, discord.Member):
+        return ctx.author
+    try:
+        return await ctx.bot.members.fetch(ctx.guild, ctx.author.id)
+    except discord.NotFound:
         return None
-    return ctx.author.top_role.id in settings.allowed_roles
 
 
-def generate_id():
-    """Generate a random 4 digit unique number"""
-    val = 0
-    while len(set(str(val))) != 4:
-        val = random.randint(1000, 9999)
-    return val
+async def can_announce(ctx):
+    """Check if the author is the guild owner, an administrator or has an allowed role
+
+    Only relies on the author's member data and `guild.owner_id`, so it works without the member cache
+    """
+    member = await resolve_member(ctx)
+    if member is None:
+        return False
+    return (
+        member.id == ctx.guild.owner_id
+        or member.guild_permissions.administrator
+        or bool(await check_allowed(ctx, member))
+    )
+
+
+def peak_rss_mib():
+    """Peak resident set size of this process in MiB, `None` where it can't be read (e.g. Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB everywhere else
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
 
 class DottedDict(object):
     def __init__(self, data: dict):